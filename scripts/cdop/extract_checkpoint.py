@@ -0,0 +1,161 @@
+"""
+JSONL checkpoint shared by the ICH extraction scripts (ich_llm_extract_batch_cd.py,
+ich_llm_extract_new.py).
+
+Each finished extraction is appended as one line to the extractions file, and
+a small meta file holds the run totals; the consolidated single-JSON output is
+assembled from these at the end. A document retried after failing has several
+lines, and only its last one counts.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from scripts.shared.json_io import json_bytes, json_loads
+
+
+class ExtractionCheckpoint:
+    """Checkpoint files and run totals for one extraction run.
+
+    results is the run's totals dict (including "total_documents",
+    "successful" and "failed"); it is written to meta_file and as the header
+    of output_file. Use as a context manager to hold the extractions file
+    open for appending while extractions are recorded.
+    """
+
+    def __init__(self, results: dict, output_file, extractions_file, meta_file):
+        self.results = results
+        self.output_file = Path(output_file)
+        self.extractions_file = Path(extractions_file)
+        self.meta_file = Path(meta_file)
+        self.out = None
+
+    def __enter__(self):
+        self.out = open(self.extractions_file, 'ab')
+        return self
+
+    def __exit__(self, *exc):
+        self.out.close()
+        self.out = None
+
+    def iter_extractions(self):
+        """Yield the extractions in the extractions file, one per line."""
+        with open(self.extractions_file, 'rb') as f:
+            for line in f:
+                yield json_loads(line)
+
+    def load(self) -> set:
+        """Restore counts from the extractions file (or a legacy output_file); return the IDs done.
+
+        Only IDs and counters are kept, so memory stays small however long the run.
+        Only successful extractions count as done. Documents whose last attempt
+        failed are left out, so this run retries them.
+        """
+        results = self.results
+        done_ids = set()
+        failed_ids = set()
+        if not self.extractions_file.exists() and self.output_file.exists():
+            # Checkpoint from before the JSONL format: carry it over
+            with open(self.output_file, 'rb') as f:
+                existing = json_loads(f.read())
+            results["extraction_date"] = existing.get("extraction_date", results["extraction_date"])
+            with open(self.extractions_file, 'wb') as f:
+                for e in existing.get("extractions", []):
+                    f.write(json_bytes(e) + b'\n')
+            del existing
+
+        if self.extractions_file.exists():
+            with open(self.extractions_file, 'rb+') as f:
+                pos = 0
+                for line in iter(f.readline, b''):
+                    try:
+                        e = json_loads(line)
+                    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
+                        f.truncate(pos)  # partial last line from an interrupted write
+                        break
+                    pos = f.tell()
+                    (failed_ids if "error" in e else done_ids).add(e.get("ich_id"))
+            results["successful"] = len(done_ids)
+            failed_ids -= done_ids
+            if failed_ids:
+                print(f"Retrying {len(failed_ids)} documents that failed on an earlier run")
+            if self.meta_file.exists():
+                with open(self.meta_file, 'rb') as f:
+                    results["extraction_date"] = json_loads(f.read()).get(
+                        "extraction_date", results["extraction_date"])
+
+        return done_ids
+
+    def record(self, ich_id: str, extraction: dict):
+        """Count one extraction and append it to the open extractions file."""
+        results = self.results
+        extraction.setdefault("ich_id", ich_id)
+        n_done = results["successful"] + results["failed"] + 1
+        n_total = results["total_documents"]
+        print(f"[{n_done}/{n_total}] {ich_id}:", end=" ")
+
+        if "error" in extraction:
+            print(f"ERROR: {extraction['error'][:50]}")
+            results["failed"] += 1
+        else:
+            n_practice = len(extraction.get('practice_locations', []))
+            n_diaspora = len(extraction.get('diaspora_locations', []))
+            has_coords = extraction.get('coordinates', {}).get('explicit', False)
+            print(f"OK (practice:{n_practice}, diaspora:{n_diaspora}, coords:{has_coords})")
+            results["successful"] += 1
+
+        self.out.write(json_bytes(extraction) + b'\n')
+        self.out.flush()
+        os.fsync(self.out.fileno())
+
+        # Refresh the totals sidecar every 10 documents
+        if n_done % 10 == 0:
+            self.save_meta()
+
+    def record_concurrent(self, work, ich_ids, max_workers: int):
+        """Run work(ich_id) for each ID on a thread pool, recording results as they finish."""
+        # Workers only do I/O; results, counters and checkpoints stay on this thread
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(work, ich_id): ich_id for ich_id in ich_ids}
+            for future in as_completed(futures):
+                self.record(futures[future], future.result())
+
+    def save_meta(self):
+        """Write the run totals to meta_file."""
+        tmp = self.meta_file.with_name(self.meta_file.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(json_bytes(self.results, indent=True))
+        os.replace(tmp, self.meta_file)
+
+    def save_results(self) -> dict:
+        """Write output_file (run totals + all extractions) by streaming the extractions file.
+
+        Produces the same indented JSON as dumping the full results dict,
+        without holding the extractions in memory, and written to a temp file
+        that is renamed into place, so a run killed mid-write leaves the
+        previous file intact. Returns summary stats gathered on the way.
+        """
+        last_line = {e.get("ich_id"): n for n, e in enumerate(self.iter_extractions())}
+
+        stats = {"coords": 0, "practice": 0, "diaspora": 0}
+        header = json_bytes({**self.results, "extractions": []}, indent=True)
+        # Open the (empty) extractions list and stream the entries into it
+        head, tail = header.rsplit(b'"extractions": []', 1)
+        tmp = self.output_file.with_name(self.output_file.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(head + b'"extractions": [')
+            i = -1
+            for n, e in enumerate(self.iter_extractions()):
+                if last_line[e.get("ich_id")] != n:
+                    continue
+                i += 1
+                if 'error' not in e:
+                    stats["coords"] += bool(e.get('coordinates', {}).get('explicit', False))
+                    stats["practice"] += len(e.get('practice_locations', []))
+                    stats["diaspora"] += len(e.get('diaspora_locations', []))
+                entry = json_bytes(e, indent=True).replace(b'\n', b'\n    ')
+                f.write((b',\n    ' if i else b'\n    ') + entry)
+            f.write((b'\n  ]' if i >= 0 else b']') + tail)
+        os.replace(tmp, self.output_file)
+        return stats
@@ -1,9 +1,7 @@
 """
 Compare ICH data sources for a specific element
 """
-import sys
 import json
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 
 from scripts.shared.db_utils import db_connect
 from psycopg.rows import dict_row
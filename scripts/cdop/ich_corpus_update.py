@@ -36,16 +36,33 @@ Date: January 2026
 """
 
 import os
-import sys
 import json
 import re
 import time
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from urllib.parse import urljoin
 import requests
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+
+from scripts.cdop.parse_list_fast import LIST_PARSER, parse_list_page
+
+# Optional: requests-cache for an on-disk HTTP cache, so reruns skip the network
+try:
+    import requests_cache
+    HAS_REQUESTS_CACHE = True
+except ImportError:
+    HAS_REQUESTS_CACHE = False
+
+# Optional: selectolax (Lexbor C parser) for fast element-page parsing;
+# falls back to BeautifulSoup when not installed
+try:
+    from selectolax.parser import HTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
 
 # Optional: Document extraction tools
 # .doc files (old Word format) can be extracted with:
@@ -56,11 +73,13 @@ from bs4 import BeautifulSoup
 import subprocess
 import shutil
 import platform
+import tempfile
 
 # Check available extraction tools
 HAS_TEXTUTIL = platform.system() == 'Darwin' and shutil.which('textutil') is not None
 HAS_ANTIWORD = shutil.which('antiword') is not None
 HAS_CATDOC = shutil.which('catdoc') is not None
+SOFFICE = shutil.which('soffice') or shutil.which('libreoffice')
 
 if HAS_TEXTUTIL:
     print("Using textutil (macOS built-in) for .doc extraction")
@@ -68,6 +87,8 @@ elif HAS_ANTIWORD:
     print("Using antiword for .doc extraction")
 elif HAS_CATDOC:
     print("Using catdoc for .doc extraction")
+elif SOFFICE:
+    print("Using LibreOffice (soffice) for .doc extraction")
 else:
     print("Note: No .doc extraction tool found.")
     print("  On macOS, textutil should be available by default.")
@@ -89,6 +110,10 @@ TEXT_DIR = PROJECT_ROOT / "app" / "data" / "ich" / "extracted_clean_02"
 # Existing corpus location (to check what we already have)
 EXISTING_DOCS_DIR = PROJECT_ROOT / "app" / "data" / "ich" / "extracted_clean_02"
 
+# HTTP cache (used when requests-cache is installed)
+HTTP_CACHE_FILE = OUTPUT_DIR / "http_cache"
+HTTP_CACHE_EXPIRE = timedelta(days=7)
+
 # Rate limiting: be polite to UNESCO servers
 REQUEST_DELAY = 1.0  # seconds between requests
 REQUEST_TIMEOUT = 30  # seconds
@@ -100,9 +125,25 @@ USER_AGENT = "CEDOP-Research-Crawler/1.0 (Academic research; non-commercial)"
 # HELPER FUNCTIONS
 # =============================================================================
 
-def get_session():
-    """Create a requests session with appropriate headers."""
-    session = requests.Session()
+def get_session(force_refresh=False):
+    """
+    Create a requests session with appropriate headers.
+
+    With requests-cache installed, responses are cached on disk (sqlite) for
+    HTTP_CACHE_EXPIRE; force_refresh clears the cache first.
+    """
+    if HAS_REQUESTS_CACHE:
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        session = requests_cache.CachedSession(
+            str(HTTP_CACHE_FILE),
+            backend='sqlite',
+            expire_after=HTTP_CACHE_EXPIRE,
+            allowable_codes=[200],
+        )
+        if force_refresh:
+            session.cache.clear()
+    else:
+        session = requests.Session()
     session.headers.update({
         "User-Agent": USER_AGENT,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
@@ -111,11 +152,14 @@ def get_session():
     return session
 
 
-def polite_request(session, url, delay=REQUEST_DELAY):
+def polite_request(session, url, delay=REQUEST_DELAY, stream=False):
     """Make a request with rate limiting and error handling."""
-    time.sleep(delay)
+    # Cached responses never reach the server, so don't pay the delay for them
+    cache = getattr(session, 'cache', None)
+    if cache is None or not cache.contains(url=url):
+        time.sleep(delay)
     try:
-        response = session.get(url, timeout=REQUEST_TIMEOUT)
+        response = session.get(url, timeout=REQUEST_TIMEOUT, stream=stream)
         response.raise_for_status()
         return response
     except requests.RequestException as e:
@@ -123,6 +167,48 @@ def polite_request(session, url, delay=REQUEST_DELAY):
         return None
 
 
+# content-type substring -> file extension (first match wins, default .doc)
+_EXT_RULES = (
+    ('application/pdf', '.pdf'),
+    ('openxmlformats-officedocument.wordprocessingml', '.docx'),
+    ('msword', '.doc'),
+)
+
+
+def _ext_for(content_type):
+    return next((ext for sub, ext in _EXT_RULES if sub in content_type), '.doc')
+
+
+def download_doc(session, doc_url, ich_id):
+    """
+    Stream a nomination doc to its path in PDF_DIR.
+
+    The extension is chosen from the response headers before the body is
+    read, so the file is opened once. The body goes to a .part file that is
+    renamed into place only when complete, so an interrupted download never
+    looks like an existing doc. Returns (path, size, content_type), or None
+    if the request failed.
+    """
+    response = polite_request(session, doc_url, stream=True)
+    if not response:
+        return None
+    content_type = response.headers.get('content-type', '')
+    doc_path = PDF_DIR / f"{ich_id}_nomination{_ext_for(content_type)}"
+    part_path = doc_path.with_name(doc_path.name + '.part')
+    size = 0
+    try:
+        with response, open(part_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+                size += len(chunk)
+    except (requests.RequestException, OSError) as e:
+        print(f"  Error fetching {doc_url}: {e}")
+        part_path.unlink(missing_ok=True)
+        return None
+    os.replace(part_path, doc_path)
+    return doc_path, size, content_type
+
+
 def get_existing_doc_ids():
     """
     Get set of ICH IDs for which we already have nomination documents.
@@ -145,81 +231,6 @@ def get_existing_doc_ids():
 # STEP 1: DISCOVER - Parse list page, identify targets
 # =============================================================================
 
-def parse_list_page(html_content):
-    """
-    Parse the ICH lists page to extract all inscribed elements.
-
-    Returns list of dicts with:
-    - ich_id: 5-digit ID (e.g., "02329")
-    - name: Element name
-    - url: Full URL to element page
-    - list_type: RL (Representative), USL (Urgent), BSP (Best Practice)
-    - country: Country name(s)
-    - year: Inscription year
-    """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    elements = []
-    current_year = None
-    current_list_type = None
-
-    # The page structure has year headers and list type subheaders
-    # followed by table rows with elements
-
-    # Find all table rows with element links
-    for row in soup.find_all('tr'):
-        # Check for year header (th with id like "2025")
-        year_th = row.find('th', id=re.compile(r'^\d{4}$'))
-        if year_th:
-            current_year = year_th.get('id')
-            continue
-
-        # Check for list type header
-        list_header = row.find('th')
-        if list_header:
-            header_text = list_header.get_text(strip=True)
-            if 'Urgent Safeguarding' in header_text:
-                current_list_type = 'USL'
-            elif 'Representative' in header_text:
-                current_list_type = 'RL'
-            elif 'Good Safeguarding' in header_text or 'Best' in header_text:
-                current_list_type = 'BSP'
-            continue
-
-        # Look for element links in table cells
-        cells = row.find_all('td', class_='list-element')
-        if len(cells) >= 2:
-            # First cell has the element link
-            link = cells[0].find('a', href=re.compile(r'/en/(RL|USL|BSP)/'))
-            if link:
-                href = link.get('href', '')
-                name = link.get_text(strip=True)
-                ich_id = link.get('title', '')
-
-                # Extract list type from URL if not already set
-                url_match = re.search(r'/en/(RL|USL|BSP)/', href)
-                if url_match:
-                    list_type = url_match.group(1)
-                else:
-                    list_type = current_list_type
-
-                # Second cell usually has country
-                country = cells[1].get_text(strip=True) if len(cells) > 1 else ''
-
-                # Normalize URL
-                full_url = urljoin(BASE_URL, href.split('#')[0])  # Remove fragment
-
-                elements.append({
-                    'ich_id': ich_id,
-                    'name': name,
-                    'url': full_url,
-                    'list_type': list_type,
-                    'country': country,
-                    'year': current_year,
-                })
-
-    return elements
-
-
 def discover_targets(session, force_refresh=False):
     """
     Step 1: Parse list page and identify elements to fetch.
@@ -246,14 +257,11 @@ def discover_targets(session, force_refresh=False):
         print(f"  Using local copy: {local_list}")
         with open(local_list, 'r', encoding='utf-8') as f:
             html = f.read()
-        # Note: local copy is in view-source format, need to clean it
-        # For now, let's fetch fresh from web
+        # Note: local copy is in view-source format; prefer a fresh fetch
         response = polite_request(session, LIST_URL)
         if not response:
-            print("  Failed to fetch list page. Using local copy with view-source cleanup.")
-            # Basic cleanup of view-source format (this is hacky but workable)
-            html = re.sub(r'<span[^>]*class="[^"]*"[^>]*>', '', html)
-            html = re.sub(r'</span>', '', html)
+            print("  Failed to fetch list page. Parsing local copy in recover mode.")
+            html = lxml_html.fromstring(html, parser=LIST_PARSER)
         else:
             html = response.text
     else:
@@ -264,7 +272,7 @@ def discover_targets(session, force_refresh=False):
         html = response.text
 
     print("Parsing list page...")
-    all_elements = parse_list_page(html)
+    all_elements = parse_list_page(html, BASE_URL)
     print(f"  Found {len(all_elements)} total elements")
 
     # Get existing document IDs
@@ -321,6 +329,63 @@ def discover_targets(session, force_refresh=False):
 # STEP 2: FETCH - Get element pages and download PDFs
 # =============================================================================
 
+_INSCRIBED_RE = re.compile(r'Inscribed in (\d{4})')
+
+
+def _parse_element_page_fast(html_content, ich_id):
+    """selectolax version of the full parse in parse_element_page (same output)."""
+    tree = HTMLParser(html_content)
+    result = {'ich_id': ich_id}
+
+    meta_desc = tree.css_first('meta[name=DESCRIPTION]')
+    if meta_desc is not None:
+        result['summary'] = meta_desc.attributes.get('content') or ''
+
+    for p in tree.css('div.element-item p.wiki-text'):
+        text = p.text(strip=True)
+        if len(text) > 200:
+            result['summary_full'] = text
+            break
+
+    nom_section = tree.css_first('div.nomination-file')
+    if nom_section is not None:
+        # One pass over list items: pick the nomination form link and
+        # collect every document link at the same time
+        all_docs = []
+        for li in nom_section.css('li'):
+            li_text = li.text()
+            doc_type = li_text.split(':')[0].strip() if ':' in li_text else 'Unknown'
+            links = li.css('a[href*="download.php"]')
+            for link in links:
+                all_docs.append({
+                    'type': doc_type,
+                    'label': link.text(strip=True),
+                    'url': urljoin(BASE_URL, link.attributes['href'])
+                })
+            if 'Nomination form' in li_text and 'nomination_doc_url' not in result and links:
+                # Prefer English version, else first link
+                chosen = next((a for a in links
+                               if 'english' in a.text(strip=True).lower()), links[0])
+                result['nomination_doc_url'] = urljoin(BASE_URL, chosen.attributes['href'])
+        if all_docs:
+            result['all_documents'] = all_docs
+
+    title = tree.css_first('h1.page-title')
+    if title is not None:
+        result['title'] = title.text(strip=True)
+
+    country_p = tree.css_first('p.element-country')
+    if country_p is not None:
+        result['country'] = country_p.text(strip=True)
+
+    body = tree.body if tree.body is not None else tree.root
+    match = _INSCRIBED_RE.search(body.text()) if body is not None else None
+    if match:
+        result['year_inscribed'] = match.group(1)
+
+    return result
+
+
 def parse_element_page(html_content, ich_id):
     """
     Parse an individual element page to extract:
@@ -328,6 +393,9 @@ def parse_element_page(html_content, ich_id):
     - Nomination form PDF URL
     - Other metadata
     """
+    if HAS_SELECTOLAX:
+        return _parse_element_page_fast(html_content, ich_id)
+
     soup = BeautifulSoup(html_content, 'html.parser')
     result = {'ich_id': ich_id}
 
@@ -468,21 +536,13 @@ def fetch_elements(session, discovery, limit=None):
 
             if not doc_path.exists():
                 print(f"  Downloading nomination doc...")
-                doc_response = polite_request(session, doc_url)
-                if doc_response:
-                    content_type = doc_response.headers.get('content-type', '')
-                    # Check content type and adjust extension if needed
-                    if 'pdf' in content_type:
-                        doc_path = PDF_DIR / f"{ich_id}_nomination.pdf"
-                    elif 'openxmlformats' in content_type:
-                        doc_path = PDF_DIR / f"{ich_id}_nomination.docx"
-
-                    with open(doc_path, 'wb') as f:
-                        f.write(doc_response.content)
+                downloaded = download_doc(session, doc_url, ich_id)
+                if downloaded:
+                    doc_path, size, content_type = downloaded
                     page_data['doc_downloaded'] = True
                     page_data['doc_path'] = str(doc_path)
                     page_data['doc_content_type'] = content_type
-                    print(f"  Saved: {doc_path.name} ({len(doc_response.content)} bytes)")
+                    print(f"  Saved: {doc_path.name} ({size} bytes)")
                 else:
                     print(f"  Doc download failed")
                     page_data['doc_downloaded'] = False
@@ -571,7 +631,12 @@ def check_gap_elements(session, discovery, limit=None):
             results['errors'].append(elem)
             continue
 
-        page_data = parse_element_page(response.text, ich_id)
+        # Only the doc link matters here: a page without a nomination-file
+        # section has none, so skip parsing it
+        if 'nomination-file' in response.text:
+            page_data = parse_element_page(response.text, ich_id)
+        else:
+            page_data = {'ich_id': ich_id}
 
         if 'nomination_doc_url' in page_data:
             print(f"HAS DOC")
@@ -647,6 +712,13 @@ def fetch_gap_docs(session, limit=None):
         'failed': []
     }
 
+    # Index existing downloads once (one directory scan, not one per element)
+    existing_by_id = {
+        entry.name.split('_', 1)[0]: entry.name
+        for entry in os.scandir(PDF_DIR)
+        if '_nomination.' in entry.name
+    }
+
     for i, elem in enumerate(has_docs):
         ich_id = elem['ich_id']
         doc_url = elem.get('doc_url')
@@ -657,33 +729,21 @@ def fetch_gap_docs(session, limit=None):
             continue
 
         # Check if already downloaded
-        existing_files = list(PDF_DIR.glob(f"{ich_id}_nomination.*"))
-        if existing_files:
+        if ich_id in existing_by_id:
             print(f"[{i+1}/{len(has_docs)}] {ich_id} - already downloaded, skipping")
             results['skipped'].append(ich_id)
             continue
 
         print(f"[{i+1}/{len(has_docs)}] Downloading {ich_id}: {elem['name'][:40]}...")
 
-        doc_response = polite_request(session, doc_url)
-        if doc_response:
-            content_type = doc_response.headers.get('content-type', '')
-            # Determine extension
-            if 'pdf' in content_type:
-                ext = '.pdf'
-            elif 'openxmlformats' in content_type:
-                ext = '.docx'
-            else:
-                ext = '.doc'
-
-            doc_path = PDF_DIR / f"{ich_id}_nomination{ext}"
-            with open(doc_path, 'wb') as f:
-                f.write(doc_response.content)
-            print(f"  Saved: {doc_path.name} ({len(doc_response.content)} bytes)")
+        downloaded = download_doc(session, doc_url, ich_id)
+        if downloaded:
+            doc_path, size, _ = downloaded
+            print(f"  Saved: {doc_path.name} ({size} bytes)")
             results['downloaded'].append({
                 'ich_id': ich_id,
                 'path': str(doc_path),
-                'size': len(doc_response.content)
+                'size': size
             })
         else:
             print(f"  Download failed")
@@ -716,6 +776,8 @@ def extract_doc_text(doc_path):
     1. textutil (macOS built-in) - preferred
     2. antiword
     3. catdoc
+    4. LibreOffice (soffice), only when none of the above is installed;
+       batch_extract_doc_texts() runs it once for all pending files
 
     Note: .doc (old Word format) requires command-line tools.
     .docx can use python-docx but is less common in this corpus.
@@ -781,6 +843,24 @@ def extract_doc_text(doc_path):
         return None
 
     elif doc_path.suffix.lower() == '.pdf':
+        # Fast path: pypdfium2 (PDFium bindings), much faster than pdfminer
+        try:
+            import pypdfium2 as pdfium
+            pdf = pdfium.PdfDocument(str(doc_path))
+            try:
+                text_parts = []
+                for page in pdf:
+                    page_text = page.get_textpage().get_text_range()
+                    if page_text:
+                        text_parts.append(page_text)
+            finally:
+                pdf.close()
+            return '\n\n'.join(text_parts)
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"  pypdfium2 error, falling back to pdfplumber: {e}")
+
         # Fallback for PDF files
         try:
             import pdfplumber
@@ -801,11 +881,51 @@ def extract_doc_text(doc_path):
     return None
 
 
+def batch_extract_doc_texts(doc_paths):
+    """
+    Convert many .doc files to text with a single converter process.
+
+    Uses one textutil invocation on macOS, or one headless LibreOffice run
+    when neither antiword nor catdoc is installed, so process startup is paid
+    once rather than per document. This keeps extract_doc_text()'s preferred
+    order: where antiword or catdoc is available, nothing is batched.
+    Returns {doc_path: text} for the files that converted; anything missing
+    falls back to per-file extract_doc_text().
+    """
+    doc_paths = [Path(p) for p in doc_paths]
+    use_soffice = SOFFICE and not (HAS_ANTIWORD or HAS_CATDOC)
+    if not doc_paths or not (HAS_TEXTUTIL or use_soffice):
+        return {}
+
+    texts = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        if HAS_TEXTUTIL:
+            cmd = ['textutil', '-convert', 'txt', '-outputdir', out_dir]
+        else:
+            # Explicit UTF-8 filter option: plain txt:Text uses the platform encoding
+            cmd = [SOFFICE, '--headless', '--convert-to', 'txt:Text (encoded):UTF8', '--outdir', out_dir]
+        try:
+            subprocess.run(cmd + [str(p) for p in doc_paths],
+                           capture_output=True, timeout=60 * len(doc_paths))
+        except Exception as e:
+            print(f"  Batch conversion exception: {e}")
+            return {}
+
+        # Both converters write <stem>.txt per input
+        for doc_path in doc_paths:
+            txt_path = Path(out_dir) / f"{doc_path.stem}.txt"
+            if txt_path.exists():
+                texts[str(doc_path)] = txt_path.read_text(encoding='utf-8', errors='replace')
+
+    print(f"  Batch converted {len(texts)}/{len(doc_paths)} .doc files")
+    return texts
+
+
 def extract_all_docs(progress):
     """
     Step 3: Extract text from all downloaded nomination documents.
 
-    Handles .doc (antiword/catdoc), .docx (python-docx), and .pdf (pdfplumber).
+    Handles .doc (textutil/antiword/catdoc/soffice), .docx (python-docx), and .pdf (pypdfium2/pdfplumber).
     """
     TEXT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -818,6 +938,15 @@ def extract_all_docs(progress):
     with_docs = [r for r in results if r.get('doc_downloaded') and r.get('doc_path')]
     print(f"\nExtracting text from {len(with_docs)} documents...")
 
+    # Convert all pending .doc files in one converter run
+    pending_docs = [
+        r['doc_path'] for r in with_docs
+        if Path(r['doc_path']).suffix.lower() == '.doc'
+        and Path(r['doc_path']).exists()
+        and not (TEXT_DIR / f"{r['ich_id']}_nomination_clean.txt").exists()
+    ]
+    batch_texts = batch_extract_doc_texts(pending_docs)
+
     for i, elem in enumerate(with_docs):
         ich_id = elem['ich_id']
         doc_path = elem.get('doc_path')
@@ -834,7 +963,7 @@ def extract_all_docs(progress):
 
         print(f"[{i+1}] Extracting {ich_id} ({Path(doc_path).suffix})...")
 
-        text = extract_doc_text(doc_path)
+        text = batch_texts.get(str(Path(doc_path))) or extract_doc_text(doc_path)
         if text and len(text) > 100:
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write(text)
@@ -882,7 +1011,7 @@ def main():
     if not any([args.discover, args.fetch, args.check_gaps, args.fetch_gaps, args.extract, args.all]):
         args.discover = True
 
-    session = get_session()
+    session = get_session(force_refresh=args.refresh)
 
     # Step 1: Discover
     if args.discover or args.all:
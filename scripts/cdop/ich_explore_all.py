@@ -0,0 +1,26 @@
+"""
+ICH Data Exploration - all phases over a single database connection
+
+Runs Phase 1 (concepts), Phase 2 (geography) and Phase 3 (text) in sequence,
+paying the connection handshake/auth once instead of once per script.
+"""
+
+from scripts.shared.console import block_buffered_stdout
+from scripts.shared.db_utils import db_connect
+from scripts.cdop import ich_explore_concepts, ich_explore_geography, ich_explore_text
+
+
+def main():
+    conn = db_connect(schema="cdop")
+    try:
+        ich_explore_concepts.main(conn)
+        ich_explore_geography.main(conn)
+        ich_explore_text.main(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Block-buffered: the reports print many short lines
+    with block_buffered_stdout():
+        main()
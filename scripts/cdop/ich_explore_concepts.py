@@ -1,67 +1,109 @@
 """
 ICH Data Exploration - Phase 1: Concept Taxonomy Analysis
 """
+import csv
 import sys
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 
+from scripts.shared.console import block_buffered_stdout
 from scripts.shared.db_utils import db_connect
 from psycopg.rows import dict_row
 
-def run_query(conn, query, description):
-    """Run a query and print results."""
+def _print_plan(node, depth=0):
+    """Print one line per plan node with its row count and buffer/sort/memory figures."""
+    parts = [f"{node['Node Type']}"]
+    if 'Relation Name' in node:
+        parts.append(f"on {node['Relation Name']}")
+    parts.append(f"rows={node.get('Actual Rows')}")
+    parts.append(f"time={node.get('Actual Total Time')}ms")
+    parts.append(f"shared hit={node.get('Shared Hit Blocks', 0)} read={node.get('Shared Read Blocks', 0)}")
+    for key in ('Sort Method', 'Peak Memory Usage'):
+        if key in node:
+            parts.append(f"{key}={node[key]}")
+    print(f"{'  ' * depth}-> {' '.join(parts)}")
+    for child in node.get('Plans', []):
+        _print_plan(child, depth + 1)
+
+def run_query(conn, query, description, itersize=1000, explain=False):
+    """Run a query and write its rows to stdout as CSV, streamed from a server-side cursor.
+
+    With explain=True the query is run under EXPLAIN (ANALYZE, BUFFERS) instead
+    and the plan tree is printed in place of the rows.
+    """
     print(f"\n{'='*60}")
     print(f"{description}")
     print('='*60)
-    with conn.cursor(row_factory=dict_row) as cur:
+    if explain:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query)
+            plan = cur.fetchone()[0][0]
+        _print_plan(plan['Plan'])
+        print(f"Planning time: {plan['Planning Time']}ms  Execution time: {plan['Execution Time']}ms")
+        sys.stdout.flush()
+        return plan['Plan'].get('Actual Rows')
+    with conn.cursor(name='run_query') as cur:
+        cur.itersize = itersize
         cur.execute(query)
-        rows = cur.fetchall()
-        for row in rows:
-            print(dict(row))
-        print(f"\n({len(rows)} rows)")
-    return rows
-
-def main():
-    conn = db_connect(schema="cdop")
+        writer = csv.writer(sys.stdout)
+        writer.writerow([col.name for col in cur.description])
+        writer.writerows(cur)
+        n_rows = cur.rownumber
+    sys.stdout.write(f"\n({n_rows} rows)\n")
+    sys.stdout.flush()
+    return n_rows
+
+def main(conn=None):
+    """Run the report; uses `conn` if given (left open), else opens its own."""
+    own_conn = conn is None
+    if own_conn:
+        conn = db_connect(schema="cdop")
 
     # 1. Get all distinct concepts with counts
     print("\n" + "="*60)
     print("1. ALL DISTINCT CONCEPTS (with element counts)")
     print("="*60)
 
+    # ich_element_concepts: persisted unnest of ich_elements.primary_concepts
+    # (see sql/cdop/ich_exploration_schema.sql)
     query1 = """
     SELECT concept, count(*) as element_count
-    FROM (
-        SELECT ich_id, trim(unnest(string_to_array(primary_concepts, '; '))) as concept
-        FROM cdop.ich_elements
-        WHERE primary_concepts IS NOT NULL AND primary_concepts != ''
-    ) sub
+    FROM cdop.ich_element_concepts
     GROUP BY concept
     ORDER BY element_count DESC;
     """
 
-    with conn.cursor(row_factory=dict_row) as cur:
+    # Categorize concepts; the same list is passed to queries 2 and 3 as a
+    # text[] parameter rather than being repeated as SQL literals
+    env_concepts = ['Mountains', 'Drylands', 'Forests', 'Grasslands, savannahs',
+                    'Marine, coastal and island areas', 'Inland wetlands']
+    env_set = frozenset(env_concepts)
+
+    # Stream the concept list once, keeping only what gets printed
+    env_rows = []
+    top_other_rows = []
+    other_count = 0
+    total_concepts = 0
+    with conn.cursor(name='concepts', row_factory=dict_row) as cur:
+        cur.itersize = 1000
         cur.execute(query1)
-        concepts = cur.fetchall()
-
-        # Categorize concepts
-        env_concepts = ['Mountains', 'Drylands', 'Forests', 'Grasslands, savannahs',
-                        'Marine, coastal and island areas', 'Inland wetlands']
-
-        print("\n--- ENVIRONMENTAL CONCEPTS ---")
-        for row in concepts:
-            if row['concept'] in env_concepts:
-                print(f"  {row['concept']}: {row['element_count']}")
-
-        print("\n--- OTHER CONCEPTS (top 30) ---")
-        other_count = 0
-        for row in concepts:
-            if row['concept'] not in env_concepts:
+        for row in cur:
+            total_concepts += 1
+            if row['concept'] in env_set:
+                env_rows.append(row)
+            else:
                 if other_count < 30:
-                    print(f"  {row['concept']}: {row['element_count']}")
+                    top_other_rows.append(row)
                 other_count += 1
-        print(f"\n  ... and {other_count - 30} more concepts" if other_count > 30 else "")
 
-        print(f"\nTotal distinct concepts: {len(concepts)}")
+    print("\n--- ENVIRONMENTAL CONCEPTS ---")
+    for row in env_rows:
+        print(f"  {row['concept']}: {row['element_count']}")
+
+    print("\n--- OTHER CONCEPTS (top 30) ---")
+    for row in top_other_rows:
+        print(f"  {row['concept']}: {row['element_count']}")
+    print(f"\n  ... and {other_count - 30} more concepts" if other_count > 30 else "")
+
+    print(f"\nTotal distinct concepts: {total_concepts}")
 
     # 2. Environmental concept co-occurrence with other concepts
     print("\n" + "="*60)
@@ -69,26 +111,18 @@ def main():
     print("="*60)
 
     query2 = """
-    SELECT e1.concept as env_concept, e2.concept as co_concept, count(*) as count
-    FROM (
-        SELECT ich_id, trim(unnest(string_to_array(primary_concepts, '; '))) as concept
-        FROM cdop.ich_elements
-    ) e1
-    JOIN (
-        SELECT ich_id, trim(unnest(string_to_array(primary_concepts, '; '))) as concept
-        FROM cdop.ich_elements
-    ) e2 ON e1.ich_id = e2.ich_id
-    WHERE e1.concept IN ('Mountains','Drylands','Forests','Grasslands, savannahs',
-                         'Marine, coastal and island areas','Inland wetlands')
-      AND e2.concept NOT IN ('Mountains','Drylands','Forests','Grasslands, savannahs',
-                             'Marine, coastal and island areas','Inland wetlands')
+    SELECT env.concept as env_concept, other.concept as co_concept, count(*) as count
+    FROM cdop.ich_element_concepts env
+    JOIN cdop.ich_element_concepts other ON other.ich_id = env.ich_id
+    WHERE env.concept = ANY(%(env)s)
+      AND NOT (other.concept = ANY(%(env)s))
     GROUP BY 1,2
     ORDER BY 3 DESC
     LIMIT 25;
     """
 
     with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(query2)
+        cur.execute(query2, {'env': env_concepts})
         for row in cur.fetchall():
             print(f"  {row['env_concept']} + {row['co_concept']}: {row['count']}")
 
@@ -97,24 +131,39 @@ def main():
     print("3. SAMPLE ELEMENTS BY ENVIRONMENTAL CONCEPT")
     print("="*60)
 
-    for env in ['Mountains', 'Drylands', 'Marine, coastal and island areas']:
-        query3 = f"""
+    sample_envs = ['Mountains', 'Drylands', 'Marine, coastal and island areas']
+
+    # primary_concepts_arr: see sql/cdop/ich_exploration_schema.sql
+    query3 = """
+    SELECT c.concept, t.ich_id, t.label, t.countries
+    FROM unnest(%(env)s::text[]) WITH ORDINALITY AS c(concept, ord)
+    CROSS JOIN LATERAL (
         SELECT e.ich_id, e.label, e.countries
         FROM cdop.ich_elements e
-        WHERE e.primary_concepts LIKE '%{env}%'
-        LIMIT 5;
-        """
+        WHERE e.primary_concepts_arr @> ARRAY[c.concept]
+        LIMIT 5
+    ) t
+    ORDER BY c.ord;
+    """
+    samples = {env: [] for env in sample_envs}
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(query3, {'env': sample_envs})
+        for row in cur.fetchall():
+            samples[row['concept']].append(row)
+
+    for env in sample_envs:
         print(f"\n--- {env.upper()} (sample of 5) ---")
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(query3)
-            for row in cur.fetchall():
-                countries = row['countries'][:50] + '...' if len(row['countries']) > 50 else row['countries']
-                print(f"  [{row['ich_id']}] {row['label'][:60]}")
-                print(f"       Countries: {countries}")
-
-    conn.close()
+        for row in samples[env]:
+            countries = row['countries'][:50] + '...' if len(row['countries']) > 50 else row['countries']
+            print(f"  [{row['ich_id']}] {row['label'][:60]}")
+            print(f"       Countries: {countries}")
+
+    if own_conn:
+        conn.close()
     print("\n" + "="*60)
     print("Phase 1 complete.")
 
 if __name__ == "__main__":
-    main()
+    # Block-buffered: the report prints many short lines
+    with block_buffered_stdout():
+        main()
@@ -3,13 +3,16 @@ ICH Data Exploration - Phase 2: Geographic Analysis
 Uses gaz.admin0 for UN subregion mapping
 """
 import sys
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 
+from scripts.shared.console import block_buffered_stdout
 from scripts.shared.db_utils import db_connect
 from psycopg.rows import dict_row
 
-def main():
-    conn = db_connect()
+def main(conn=None):
+    """Run the report; uses `conn` if given (left open), else opens its own."""
+    own_conn = conn is None
+    if own_conn:
+        conn = db_connect()
 
     # 1. First, explore the country field structure
     print("\n" + "="*60)
@@ -64,9 +67,11 @@ def main():
     print("4. ELEMENTS BY COUNTRY (top 20)")
     print("="*60)
 
+    # ich_element_countries: persisted unnest of ich_elements.countries
+    # (see sql/cdop/ich_exploration_schema.sql)
     query4 = """
-    SELECT trim(unnest(string_to_array(countries, ', '))) as country, count(*) as count
-    FROM cdop.ich_elements
+    SELECT country, count(*) as count
+    FROM cdop.ich_element_countries
     GROUP BY 1
     ORDER BY 2 DESC
     LIMIT 20;
@@ -76,19 +81,16 @@ def main():
         for row in cur.fetchall():
             print(f"  {row['country']}: {row['count']}")
 
-    # 5. Try to match countries to admin0 for subregion analysis
+    # 5. Match countries to admin0 for subregion analysis
+    # cdop.country_norm() and its indexes: see sql/cdop/ich_exploration_schema.sql
     print("\n" + "="*60)
     print("5. ELEMENTS BY UN SUBREGION")
     print("="*60)
 
     query5 = """
-    WITH country_elements AS (
-        SELECT ich_id, trim(unnest(string_to_array(countries, ', '))) as country
-        FROM cdop.ich_elements
-    )
     SELECT a.subregion, count(DISTINCT ce.ich_id) as element_count
-    FROM country_elements ce
-    LEFT JOIN gaz.admin0 a ON lower(ce.country) = lower(a.name)
+    FROM cdop.ich_element_countries ce
+    LEFT JOIN gaz.admin0 a ON cdop.country_norm(ce.country) = cdop.country_norm(a.name)
     WHERE a.subregion IS NOT NULL
     GROUP BY a.subregion
     ORDER BY element_count DESC;
@@ -104,22 +106,20 @@ def main():
     print("="*60)
 
     query6 = """
-    WITH country_elements AS (
-        SELECT DISTINCT trim(unnest(string_to_array(countries, ', '))) as country
-        FROM cdop.ich_elements
-    )
-    SELECT ce.country
-    FROM country_elements ce
-    LEFT JOIN gaz.admin0 a ON lower(ce.country) = lower(a.name)
+    SELECT DISTINCT ce.country
+    FROM cdop.ich_element_countries ce
+    LEFT JOIN gaz.admin0 a ON cdop.country_norm(ce.country) = cdop.country_norm(a.name)
     WHERE a.name IS NULL
     ORDER BY ce.country;
     """
-    with conn.cursor(row_factory=dict_row) as cur:
+    n_unmatched = 0
+    with conn.cursor(name='unmatched', row_factory=dict_row) as cur:
+        cur.itersize = 1000
         cur.execute(query6)
-        unmatched = cur.fetchall()
-        for row in unmatched:
+        for row in cur:
             print(f"  {row['country']}")
-        print(f"\n  ({len(unmatched)} unmatched countries)")
+            n_unmatched += 1
+        print(f"\n  ({n_unmatched} unmatched countries)")
 
     # 7. Multinational elements
     print("\n" + "="*60)
@@ -127,11 +127,15 @@ def main():
     print("="*60)
 
     query7 = """
-    SELECT ich_id, label, countries,
-           array_length(string_to_array(countries, ', '), 1) as country_count
-    FROM cdop.ich_elements
-    WHERE array_length(string_to_array(countries, ', '), 1) > 1
-    ORDER BY country_count DESC
+    SELECT e.ich_id, e.label, e.countries, c.country_count
+    FROM (
+        SELECT ich_id, count(*) as country_count
+        FROM cdop.ich_element_countries
+        GROUP BY ich_id
+        HAVING count(*) > 1
+    ) c
+    JOIN cdop.ich_elements e ON e.ich_id = c.ich_id
+    ORDER BY c.country_count DESC
     LIMIT 15;
     """
     with conn.cursor(row_factory=dict_row) as cur:
@@ -180,9 +184,10 @@ def main():
     GROUP BY list
     ORDER BY count DESC;
     """
-    with conn.cursor(row_factory=dict_row) as cur:
+    with conn.cursor(name='query9', row_factory=dict_row) as cur:
+        cur.itersize = 1000
         cur.execute(query9)
-        for row in cur.fetchall():
+        for row in cur:
             print(f"  {row['list']}: {row['count']}")
 
     # 10. Elements by year
@@ -196,14 +201,18 @@ def main():
     GROUP BY year
     ORDER BY year;
     """
-    with conn.cursor(row_factory=dict_row) as cur:
+    with conn.cursor(name='query10', row_factory=dict_row) as cur:
+        cur.itersize = 1000
         cur.execute(query10)
-        for row in cur.fetchall():
+        for row in cur:
             print(f"  {row['year']}: {row['count']}")
 
-    conn.close()
+    if own_conn:
+        conn.close()
     print("\n" + "="*60)
     print("Phase 2 complete.")
 
 if __name__ == "__main__":
-    main()
+    # Block-buffered: the report prints many short lines
+    with block_buffered_stdout():
+        main()
@@ -2,88 +2,91 @@
 ICH Data Exploration - Phase 3: Text Analysis Preparation
 """
 import sys
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 
+from scripts.shared.console import block_buffered_stdout
 from scripts.shared.db_utils import db_connect
 from psycopg.rows import dict_row
 
-def main():
-    conn = db_connect(schema="cdop")
+# Seed for the per-concept text samples: same seed, same sample; change it
+# to draw a different one
+SAMPLE_SEED = "ich-explore"
+
+def main(conn=None):
+    """Run the report; uses `conn` if given (left open), else opens its own."""
+    own_conn = conn is None
+    if own_conn:
+        conn = db_connect(schema="cdop")
+
+    # text_len / text_wc are stored generated columns
+    # (see sql/cdop/ich_exploration_schema.sql)
+
+    # Sections 1, 2, 3 and 8 are all aggregates over ich_summaries:
+    # compute them in one scan and format each section from the same row
+    bucket_edges = [500, 1000, 1500, 2000, 3000]
+    bucket_labels = ['< 500 chars', '500-999 chars', '1000-1499 chars',
+                     '1500-1999 chars', '2000-2999 chars', '3000+ chars']
+    bucket_counts = ",\n        ".join(
+        f"count(*) FILTER (WHERE bucket = {i}) as bucket_{i}"
+        for i in range(len(bucket_labels))
+    )
+    stats_query = f"""
+    SELECT
+        count(*) as total_elements,
+        round(avg(text_len)) as avg_chars,
+        min(text_len) as min_chars,
+        max(text_len) as max_chars,
+        percentile_disc(ARRAY[0.25, 0.50, 0.75, 0.90]) WITHIN GROUP (ORDER BY text_len) as len_pcts,
+        round(avg(text_wc)) as avg_words,
+        min(text_wc) as min_words,
+        max(text_wc) as max_words,
+        percentile_disc(0.50) WITHIN GROUP (ORDER BY text_wc) as median_words,
+        sum(text_len) as total_chars,
+        round(sum(text_len) / 4.0) as est_tokens_total,
+        round(avg(text_len) / 4.0) as est_tokens_avg,
+        {bucket_counts}
+    FROM (
+        SELECT text_len, text_wc,
+               width_bucket(text_len, %(edges)s::int[]) as bucket
+        FROM cdop.ich_summaries
+    ) s;
+    """
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(stats_query, {'edges': bucket_edges})
+        stats = cur.fetchone()
 
     # 1. Summary text length distribution
     print("\n" + "="*60)
     print("1. SUMMARY TEXT LENGTH DISTRIBUTION")
     print("="*60)
 
-    query1 = """
-    SELECT
-        count(*) as total_elements,
-        round(avg(length(text))) as avg_chars,
-        min(length(text)) as min_chars,
-        max(length(text)) as max_chars,
-        percentile_cont(0.25) WITHIN GROUP (ORDER BY length(text)) as p25,
-        percentile_cont(0.50) WITHIN GROUP (ORDER BY length(text)) as p50_median,
-        percentile_cont(0.75) WITHIN GROUP (ORDER BY length(text)) as p75,
-        percentile_cont(0.90) WITHIN GROUP (ORDER BY length(text)) as p90
-    FROM cdop.ich_summaries;
-    """
-    with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(query1)
-        row = cur.fetchone()
-        print(f"  Total elements: {row['total_elements']}")
-        print(f"  Avg chars: {row['avg_chars']}")
-        print(f"  Min chars: {row['min_chars']}")
-        print(f"  Max chars: {row['max_chars']}")
-        print(f"  25th percentile: {row['p25']}")
-        print(f"  Median (50th): {row['p50_median']}")
-        print(f"  75th percentile: {row['p75']}")
-        print(f"  90th percentile: {row['p90']}")
+    p25, p50, p75, p90 = stats['len_pcts']
+    print(f"  Total elements: {stats['total_elements']}")
+    print(f"  Avg chars: {stats['avg_chars']}")
+    print(f"  Min chars: {stats['min_chars']}")
+    print(f"  Max chars: {stats['max_chars']}")
+    print(f"  25th percentile: {p25}")
+    print(f"  Median (50th): {p50}")
+    print(f"  75th percentile: {p75}")
+    print(f"  90th percentile: {p90}")
 
     # 2. Text length buckets
     print("\n" + "="*60)
     print("2. TEXT LENGTH BUCKETS")
     print("="*60)
 
-    query2 = """
-    SELECT
-        CASE
-            WHEN length(text) < 500 THEN '< 500 chars'
-            WHEN length(text) < 1000 THEN '500-999 chars'
-            WHEN length(text) < 1500 THEN '1000-1499 chars'
-            WHEN length(text) < 2000 THEN '1500-1999 chars'
-            WHEN length(text) < 3000 THEN '2000-2999 chars'
-            ELSE '3000+ chars'
-        END as length_bucket,
-        count(*) as count
-    FROM cdop.ich_summaries
-    GROUP BY 1
-    ORDER BY min(length(text));
-    """
-    with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(query2)
-        for row in cur.fetchall():
-            print(f"  {row['length_bucket']}: {row['count']}")
+    for i, label in enumerate(bucket_labels):
+        if stats[f'bucket_{i}']:
+            print(f"  {label}: {stats[f'bucket_{i}']}")
 
     # 3. Word count distribution
     print("\n" + "="*60)
     print("3. WORD COUNT DISTRIBUTION (approximate)")
     print("="*60)
 
-    query3 = """
-    SELECT
-        round(avg(array_length(string_to_array(text, ' '), 1))) as avg_words,
-        min(array_length(string_to_array(text, ' '), 1)) as min_words,
-        max(array_length(string_to_array(text, ' '), 1)) as max_words,
-        percentile_cont(0.50) WITHIN GROUP (ORDER BY array_length(string_to_array(text, ' '), 1)) as median_words
-    FROM cdop.ich_summaries;
-    """
-    with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(query3)
-        row = cur.fetchone()
-        print(f"  Avg words: {row['avg_words']}")
-        print(f"  Min words: {row['min_words']}")
-        print(f"  Max words: {row['max_words']}")
-        print(f"  Median words: {row['median_words']}")
+    print(f"  Avg words: {stats['avg_words']}")
+    print(f"  Min words: {stats['min_words']}")
+    print(f"  Max words: {stats['max_words']}")
+    print(f"  Median words: {stats['median_words']}")
 
     # 4. Sample texts by environmental concept
     print("\n" + "="*60)
@@ -93,24 +96,35 @@ def main():
     env_concepts = ['Mountains', 'Drylands', 'Forests', 'Grasslands, savannahs',
                     'Marine, coastal and island areas', 'Inland wetlands']
 
-    for concept in env_concepts:
-        query4 = f"""
-        SELECT e.ich_id, e.label, e.countries, s.text, length(s.text) as chars
+    # One round trip: a LATERAL subquery draws 2 rows per concept
+    # (primary_concepts_arr: see sql/cdop/ich_exploration_schema.sql)
+    query4 = """
+    SELECT c.concept, t.ich_id, t.label, t.countries, t.text, t.chars
+    FROM unnest(%(concepts)s::text[]) WITH ORDINALITY AS c(concept, ord)
+    CROSS JOIN LATERAL (
+        SELECT e.ich_id, e.label, e.countries, s.text, s.text_len as chars
         FROM cdop.ich_elements e
         JOIN cdop.ich_summaries s ON e.ich_id = s.ich_id
-        WHERE e.primary_concepts LIKE '%{concept}%'
-        ORDER BY random()
-        LIMIT 2;
-        """
+        WHERE e.primary_concepts_arr @> ARRAY[c.concept]
+        ORDER BY md5(e.ich_id || %(seed)s)
+        LIMIT 2
+    ) t
+    ORDER BY c.ord;
+    """
+    samples = {concept: [] for concept in env_concepts}
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(query4, {'concepts': env_concepts, 'seed': SAMPLE_SEED})
+        for row in cur.fetchall():
+            samples[row['concept']].append(row)
+
+    for concept in env_concepts:
         print(f"\n--- {concept.upper()} ---")
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(query4)
-            for row in cur.fetchall():
-                preview = row['text'][:400].replace('\n', ' ')
-                print(f"\n  [{row['ich_id']}] {row['label'][:60]}")
-                print(f"  Countries: {row['countries'][:60]}")
-                print(f"  Length: {row['chars']} chars")
-                print(f"  Preview: {preview}...")
+        for row in samples[concept]:
+            preview = row['text'][:400].replace('\n', ' ')
+            print(f"\n  [{row['ich_id']}] {row['label'][:60]}")
+            print(f"  Countries: {row['countries'][:60]}")
+            print(f"  Length: {row['chars']} chars")
+            print(f"  Preview: {preview}...")
 
     # 5. Elements with shortest/longest summaries
     print("\n" + "="*60)
@@ -118,10 +132,10 @@ def main():
     print("="*60)
 
     query5 = """
-    SELECT e.ich_id, e.label, length(s.text) as chars, s.text
+    SELECT e.ich_id, e.label, s.text_len as chars, s.text
     FROM cdop.ich_elements e
     JOIN cdop.ich_summaries s ON e.ich_id = s.ich_id
-    ORDER BY length(s.text)
+    ORDER BY s.text_len
     LIMIT 5;
     """
     with conn.cursor(row_factory=dict_row) as cur:
@@ -135,10 +149,10 @@ def main():
     print("="*60)
 
     query6 = """
-    SELECT e.ich_id, e.label, length(s.text) as chars
+    SELECT e.ich_id, e.label, s.text_len as chars
     FROM cdop.ich_elements e
     JOIN cdop.ich_summaries s ON e.ich_id = s.ich_id
-    ORDER BY length(s.text) DESC
+    ORDER BY s.text_len DESC
     LIMIT 5;
     """
     with conn.cursor(row_factory=dict_row) as cur:
@@ -171,21 +185,11 @@ def main():
     print("8. TOKEN ESTIMATION FOR EMBEDDINGS")
     print("="*60)
 
-    query8 = """
-    SELECT
-        sum(length(text)) as total_chars,
-        round(sum(length(text)) / 4.0) as est_tokens_total,
-        round(avg(length(text)) / 4.0) as est_tokens_avg
-    FROM cdop.ich_summaries;
-    """
-    with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(query8)
-        row = cur.fetchone()
-        print(f"  Total characters: {row['total_chars']:,}")
-        print(f"  Est. total tokens (~4 chars/token): {int(row['est_tokens_total']):,}")
-        print(f"  Est. avg tokens per element: {int(row['est_tokens_avg'])}")
-        print(f"\n  OpenAI ada-002 embedding cost estimate:")
-        print(f"    ~${int(row['est_tokens_total']) * 0.0001 / 1000:.2f} (at $0.0001/1K tokens)")
+    print(f"  Total characters: {stats['total_chars']:,}")
+    print(f"  Est. total tokens (~4 chars/token): {int(stats['est_tokens_total']):,}")
+    print(f"  Est. avg tokens per element: {int(stats['est_tokens_avg'])}")
+    print(f"\n  OpenAI ada-002 embedding cost estimate:")
+    print(f"    ~${int(stats['est_tokens_total']) * 0.0001 / 1000:.2f} (at $0.0001/1K tokens)")
 
     # 9. Text content analysis - common terms
     print("\n" + "="*60)
@@ -197,21 +201,29 @@ def main():
                  'climate', 'rain', 'dry', 'tropical', 'temperate', 'pastoral',
                  'agricultural', 'fishing', 'hunting', 'herding', 'farming']
 
-    for term in env_terms:
-        query9 = f"""
-        SELECT count(*) as count
-        FROM cdop.ich_summaries
-        WHERE lower(text) LIKE '%{term}%';
-        """
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(query9)
-            row = cur.fetchone()
-            if row['count'] > 10:
-                print(f"  '{term}': {row['count']} elements")
-
-    conn.close()
+    # One scan of ich_summaries counting every term, rather than one query per term
+    term_counts = ",\n        ".join(
+        f"count(*) FILTER (WHERE lower(text) LIKE %s) as c_{i}"
+        for i in range(len(env_terms))
+    )
+    query9 = f"""
+    SELECT
+        {term_counts}
+    FROM cdop.ich_summaries;
+    """
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(query9, [f'%{term}%' for term in env_terms])
+        row = cur.fetchone()
+        for i, term in enumerate(env_terms):
+            if row[f'c_{i}'] > 10:
+                print(f"  '{term}': {row[f'c_{i}']} elements")
+
+    if own_conn:
+        conn.close()
     print("\n" + "="*60)
     print("Phase 3 complete.")
 
 if __name__ == "__main__":
-    main()
+    # Block-buffered: the report prints many short lines
+    with block_buffered_stdout():
+        main()
@@ -2,13 +2,10 @@
 ICH LLM Extraction Pipeline
 Extract structured geographic and environmental data from nomination documents using Claude API
 """
-import sys
 import os
 import json
 from datetime import datetime
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
-
 import anthropic
 from dotenv import load_dotenv
 load_dotenv()
@@ -1,14 +1,11 @@
 """
 ICH LLM Extraction - Batch processing for Tier A+B documents
 """
-import sys
 import os
 import json
 import time
 from datetime import datetime
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
-
 import anthropic
 from dotenv import load_dotenv
 load_dotenv()
@@ -1,23 +1,58 @@
 """
 ICH LLM Extraction - Batch processing for Tier C+D documents
+
+Usage:
+    python ich_llm_extract_batch_cd.py           # concurrent synchronous calls
+    python ich_llm_extract_batch_cd.py --batch   # Message Batches API
 """
-import sys
 import os
+import re
 import json
-import time
+import argparse
 from datetime import datetime
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
-
 import anthropic
 from dotenv import load_dotenv
 load_dotenv()
 
+from scripts.cdop import llm_client
+from scripts.cdop.extract_checkpoint import ExtractionCheckpoint
+from scripts.shared.rate_limit import RateLimiter
+
 TRIAGE_FILE = '/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_triage.json'
 DOC_DIR = '/Users/karlg/Documents/Repos/_cedop/app/data/ich/extracted_clean_02'
 OUTPUT_FILE = '/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_llm_extractions_tier_cd.json'
 
-EXTRACTION_PROMPT = """You are a geographic information extraction specialist. Your task is to extract structured location and environmental data from UNESCO Intangible Cultural Heritage nomination documents.
+MODEL = "claude-sonnet-4-20250514"
+
+# Concurrent API calls, and the global request-start rate shared by all of them
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 2.0
+
+# --batch mode: the submitted batch ID is kept here until its results are in,
+# so an interrupted run picks up the same batch instead of resubmitting
+BATCH_STATE_FILE = OUTPUT_FILE.replace('.json', '_batch_state.json')
+
+# Checkpoint: one extraction per line, appended as each finishes, plus a small
+# sidecar with the run totals. OUTPUT_FILE is written from these at the end.
+EXTRACTIONS_FILE = OUTPUT_FILE.replace('.json', '.jsonl')
+META_FILE = OUTPUT_FILE.replace('.json', '.meta.json')
+BATCH_POLL_SECONDS = 60
+
+# Documents longer than this are cut down to their geographic sections plus
+# leading context before sending (see truncate_by_sections)
+DOC_BUDGET_CHARS = 20000
+
+# Section headers worth keeping whole when a document is over budget
+_GEO_HEADER_RE = re.compile(r'location|geograph|region|country|village|area', re.IGNORECASE)
+
+# Stands in for the text left out of a truncated document
+TRUNCATION_MARK = '...[truncated]...'
+
+# Static instructions + schema, sent as the system prompt; only USER_TEMPLATE
+# varies per document. Not marked for prompt caching: at ~600 tokens it is
+# below the model's 1024-token minimum cacheable prefix.
+SYSTEM_PROMPT = """You are a geographic information extraction specialist. Your task is to extract structured location and environmental data from UNESCO Intangible Cultural Heritage nomination documents.
 
 IMPORTANT DISTINCTIONS:
 1. **Practice locations**: Where the cultural practice is actually performed/originated. These are the primary geographic footprint.
@@ -25,35 +60,35 @@ IMPORTANT DISTINCTIONS:
 
 EXTRACTION SCHEMA (use this exact structure):
 
-{{
+{
   "ich_id": "string - the 5-digit ID",
   "element_name": "string - name of the cultural element",
 
   "practice_locations": [
-    {{
+    {
       "name": "string - place name",
       "type": "string - one of: country, province, prefecture, county, city, town, village, island, river, mountain, region",
       "parent_admin": "string or null - parent administrative unit",
       "country": "string - ISO country name",
       "country_code": "string or null - 2-letter ISO code if known"
-    }}
+    }
   ],
 
-  "coordinates": {{
+  "coordinates": {
     "explicit": "boolean - true if lat/lon explicitly stated in document",
     "lat_min": "number or null",
     "lat_max": "number or null",
     "lon_min": "number or null",
     "lon_max": "number or null",
     "source_text": "string or null - the exact text containing coordinates"
-  }},
+  },
 
   "diaspora_locations": [
-    {{
+    {
       "name": "string - place name",
       "country": "string - country name",
       "context": "string - brief description of why mentioned (e.g., 'emigrant community', 'spread via trade')"
-    }}
+    }
   ],
 
   "environmental_features": [
@@ -63,7 +98,7 @@ EXTRACTION SCHEMA (use this exact structure):
   "environmental_summary": "string - 1-2 sentence summary of the environmental/geographic context of this practice",
 
   "extraction_notes": "string or null - any ambiguities or issues encountered during extraction"
-}}
+}
 
 GUIDELINES:
 - Be precise about location types (don't call a province a "region")
@@ -71,9 +106,9 @@ GUIDELINES:
 - Only mark coordinates as "explicit" if actual lat/lon values appear in text
 - For diaspora, look for phrases like "emigrants", "migrants", "spread to", "also practiced in [foreign country]"
 - Environmental features should focus on physical geography, not cultural features
-- If uncertain about a classification, note it in extraction_notes
+- If uncertain about a classification, note it in extraction_notes"""
 
-Now extract from this nomination document:
+USER_TEMPLATE = """Now extract from this nomination document:
 
 ---
 DOCUMENT ID: {ich_id}
@@ -84,55 +119,186 @@ DOCUMENT ID: {ich_id}
 Return ONLY valid JSON matching the schema above. No other text."""
 
 
-def find_doc_path(ich_id: str) -> str | None:
-    """Find the document file for a given ICH ID."""
-    for f in os.listdir(DOC_DIR):
-        if f.startswith(ich_id + '_') and f.endswith('.txt'):
-            return os.path.join(DOC_DIR, f)
-    return None
-
-
-def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic) -> dict:
-    """Call Claude API to extract structured data from document."""
-    prompt = EXTRACTION_PROMPT.format(
+def truncate_by_sections(document_text: str, budget_chars: int = DOC_BUDGET_CHARS) -> str:
+    """Cut a long document to roughly budget_chars, favouring geographic sections.
+
+    Sections are the blank-line-separated blocks; a block's first line is its
+    header. Blocks whose header matches _GEO_HEADER_RE are kept first (with the
+    next block when the header stands alone), then leading blocks fill the
+    remaining budget. The first leading block that does not fit whole is cut
+    to the space left, so a document with no blank lines, or one oversized
+    opening block, still comes back as a hard head cut rather than empty.
+    Kept blocks stay in document order, with TRUNCATION_MARK wherever text
+    was left out.
+    """
+    if len(document_text) <= budget_chars:
+        return document_text
+
+    blocks = document_text.split('\n\n')
+    keep = set()
+    cut = None
+    used = 0
+
+    def take(i):
+        nonlocal used
+        if i in keep or i >= len(blocks) or used + len(blocks[i]) + 2 > budget_chars:
+            return False
+        keep.add(i)
+        used += len(blocks[i]) + 2
+        return True
+
+    for i, block in enumerate(blocks):
+        header = block.lstrip().split('\n', 1)[0]
+        if _GEO_HEADER_RE.search(header):
+            if take(i) and '\n' not in block.strip():
+                take(i + 1)
+
+    for i in range(len(blocks)):
+        if take(i) or i in keep:
+            continue
+        room = budget_chars - used - 2
+        if room > 0:
+            blocks[i] = blocks[i][:room]
+            keep.add(i)
+            cut = i
+        break
+
+    parts = []
+    prev = -1
+    for i in sorted(keep):
+        if i != prev + 1 or prev == cut:
+            parts.append(TRUNCATION_MARK)
+        parts.append(blocks[i])
+        prev = i
+    if prev != len(blocks) - 1 or prev == cut:
+        parts.append(TRUNCATION_MARK)
+    return '\n\n'.join(parts)
+
+
+def build_request_params(ich_id: str, document_text: str) -> dict:
+    """Messages API parameters for one document (shared by sync and batch modes)."""
+    prompt = USER_TEMPLATE.format(
         ich_id=ich_id,
         document_text=document_text
     )
-
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        messages=[
+    return {
+        "model": MODEL,
+        "max_tokens": 4096,
+        "system": SYSTEM_PROMPT,
+        "messages": [
             {"role": "user", "content": prompt}
         ]
-    )
+    }
 
-    response_text = message.content[0].text
 
-    # Parse JSON (handle potential markdown code blocks)
-    if response_text.startswith('```'):
-        lines = response_text.split('\n')
-        json_lines = []
-        in_block = False
-        for line in lines:
-            if line.startswith('```'):
-                in_block = not in_block
-                continue
-            if in_block or not line.startswith('```'):
-                json_lines.append(line)
-        response_text = '\n'.join(json_lines)
+def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic,
+                        limiter: RateLimiter) -> dict:
+    """Call Claude API to extract structured data from document, recording token usage."""
+    usage = {}
+    extraction = llm_client.request_json(client, ich_id, build_request_params(ich_id, document_text),
+                                         limiter, usage=usage)
+    extraction["usage"] = usage
+    return extraction
+
+
+def process_doc(ich_id: str, client: anthropic.Anthropic, limiter: RateLimiter) -> dict:
+    """Read one document and extract it; failures come back as an error record."""
+    doc_path = llm_client.find_doc_path(DOC_DIR, ich_id)
+    if not doc_path:
+        return {"ich_id": ich_id, "error": "Document not found"}
+
+    document_text, lengths = llm_client.read_document(doc_path, truncate_by_sections)
 
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError as e:
-        return {
-            "ich_id": ich_id,
-            "error": f"JSON parse error: {e}",
-            "raw_response": response_text[:500]
-        }
+        extraction = extract_with_claude(ich_id, document_text, client, limiter)
+    except Exception as e:
+        extraction = {"ich_id": ich_id, "error": f"EXCEPTION: {e}"}
+    extraction.update(lengths)
+    return extraction
+
+
+def run_concurrent(client: anthropic.Anthropic, pending_ids: list, checkpoint: ExtractionCheckpoint):
+    """Extract pending documents with synchronous calls on a thread pool."""
+    # burst=1: request starts evenly spaced, as before
+    limiter = RateLimiter(REQUESTS_PER_SECOND * 60, burst=1)
+    client = client.with_options(max_retries=0)  # llm_client.create_message does the retrying
+
+    checkpoint.record_concurrent(lambda ich_id: process_doc(ich_id, client, limiter),
+                                 pending_ids, MAX_WORKERS)
+
+
+def run_batch(client: anthropic.Anthropic, pending_ids: list, checkpoint: ExtractionCheckpoint):
+    """Extract pending documents through the Message Batches API (one submission, async pricing)."""
+    if os.path.exists(BATCH_STATE_FILE):
+        with open(BATCH_STATE_FILE, 'r') as f:
+            state = json.load(f)
+        batch_id = state["batch_id"]
+        doc_lengths = state.get("doc_lengths", {})
+        print(f"Resuming batch {batch_id}")
+    else:
+        requests = []
+        doc_lengths = {}
+        for ich_id in pending_ids:
+            doc_path = llm_client.find_doc_path(DOC_DIR, ich_id)
+            if not doc_path:
+                checkpoint.record(ich_id, {"ich_id": ich_id, "error": "Document not found"})
+                continue
+            document_text, doc_lengths[ich_id] = llm_client.read_document(doc_path, truncate_by_sections)
+            requests.append({
+                "custom_id": ich_id,
+                "params": build_request_params(ich_id, document_text),
+            })
+        if not requests:
+            return
+
+        batch = client.messages.batches.create(requests=requests)
+        batch_id = batch.id
+        with open(BATCH_STATE_FILE, 'w') as f:
+            json.dump({"batch_id": batch_id, "submitted": datetime.now().isoformat(),
+                       "doc_lengths": doc_lengths}, f)
+        print(f"Submitted batch {batch_id} ({len(requests)} documents)")
+
+    llm_client.wait_for_batch(client, batch_id, BATCH_POLL_SECONDS)
+
+    # Unparseable replies get the same JSON follow-up turns as the concurrent
+    # path, sent as ordinary synchronous calls
+    sync_client = client.with_options(max_retries=0)
+    limiter = RateLimiter(REQUESTS_PER_SECOND * 60, burst=1)
+
+    # Results already checkpointed by an interrupted download are skipped
+    pending = set(pending_ids)
+    for entry in client.messages.batches.results(batch_id):
+        ich_id = entry.custom_id
+        if ich_id not in pending:
+            continue
+        if entry.result.type == "succeeded":
+            message = entry.result.message
+            usage = {}
+            llm_client.add_usage(usage, message.usage)
+            try:
+                document_text, _ = llm_client.read_document(llm_client.find_doc_path(DOC_DIR, ich_id),
+                                                            truncate_by_sections)
+                extraction = llm_client.request_json(
+                    sync_client, ich_id, build_request_params(ich_id, document_text), limiter,
+                    first_reply=message.content[0].text, usage=usage)
+            except Exception as e:
+                extraction = {"ich_id": ich_id, "error": f"EXCEPTION: {e}"}
+            extraction["usage"] = usage
+        else:
+            extraction = {"ich_id": ich_id, "error": f"Batch request {entry.result.type}"}
+        extraction.update(doc_lengths.get(ich_id, {}))
+        checkpoint.record(ich_id, extraction)
+
+    checkpoint.save_meta()
+    os.remove(BATCH_STATE_FILE)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract Tier C+D nomination documents with Claude')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit via the Message Batches API (slower turnaround, half price)')
+    args = parser.parse_args()
+
     # Load triage results
     with open(TRIAGE_FILE, 'r') as f:
         triage = json.load(f)
@@ -145,78 +311,33 @@ def main():
     print(f"Processing {len(target_ids)} documents (Tier C: {len(tier_c_ids)}, Tier D: {len(tier_d_ids)})")
 
     # Check for existing checkpoint
-    start_idx = 0
     results = {
         "extraction_date": datetime.now().isoformat(),
-        "model": "claude-sonnet-4-20250514",
+        "model": MODEL,
         "tiers_processed": ["C", "D"],
         "total_documents": len(target_ids),
         "successful": 0,
         "failed": 0,
-        "extractions": []
     }
 
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, 'r') as f:
-            existing = json.load(f)
-            if existing.get("extractions"):
-                results = existing
-                start_idx = len(existing["extractions"])
-                print(f"Resuming from checkpoint: {start_idx}/{len(target_ids)} already processed")
-
-    client = anthropic.Anthropic()
+    checkpoint = ExtractionCheckpoint(results, OUTPUT_FILE, EXTRACTIONS_FILE, META_FILE)
 
-    for i, ich_id in enumerate(target_ids[start_idx:], start=start_idx):
-        print(f"\n[{i+1}/{len(target_ids)}] Processing {ich_id}...", end=" ", flush=True)
+    # Results arrive in completion order, so resume by ID rather than position
+    done_ids = checkpoint.load()
+    if done_ids:
+        print(f"Resuming from checkpoint: {len(done_ids)}/{len(target_ids)} already processed")
+    pending_ids = [ich_id for ich_id in target_ids if ich_id not in done_ids]
 
-        doc_path = find_doc_path(ich_id)
-        if not doc_path:
-            print("NOT FOUND")
-            results["extractions"].append({
-                "ich_id": ich_id,
-                "error": "Document not found"
-            })
-            results["failed"] += 1
-            continue
-
-        with open(doc_path, 'r') as f:
-            document_text = f.read()
-
-        try:
-            extraction = extract_with_claude(ich_id, document_text, client)
-
-            if "error" in extraction:
-                print(f"ERROR: {extraction['error'][:50]}")
-                results["failed"] += 1
-            else:
-                n_practice = len(extraction.get('practice_locations', []))
-                n_diaspora = len(extraction.get('diaspora_locations', []))
-                has_coords = extraction.get('coordinates', {}).get('explicit', False)
-                print(f"OK (practice:{n_practice}, diaspora:{n_diaspora}, coords:{has_coords})")
-                results["successful"] += 1
-
-            results["extractions"].append(extraction)
-
-        except Exception as e:
-            print(f"EXCEPTION: {e}")
-            results["extractions"].append({
-                "ich_id": ich_id,
-                "error": str(e)
-            })
-            results["failed"] += 1
-
-        # Small delay to avoid rate limits
-        time.sleep(0.5)
-
-        # Save intermediate results every 10 documents
-        if (i + 1) % 10 == 0:
-            with open(OUTPUT_FILE, 'w') as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
-            print(f"  [Checkpoint saved: {i+1}/{len(target_ids)}]")
+    client = anthropic.Anthropic()
+    with checkpoint:
+        if args.batch:
+            run_batch(client, pending_ids, checkpoint)
+        else:
+            run_concurrent(client, pending_ids, checkpoint)
 
-    # Final save
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    # Final save: totals sidecar, plus the consolidated single-JSON deliverable
+    checkpoint.save_meta()
+    stats = checkpoint.save_results()
 
     # Summary
     print(f"\n{'='*60}")
@@ -229,17 +350,10 @@ def main():
 
     # Quick stats on successful extractions
     if results['successful'] > 0:
-        coords_count = sum(1 for e in results['extractions']
-                          if e.get('coordinates', {}).get('explicit', False))
-        avg_practice = sum(len(e.get('practice_locations', []))
-                          for e in results['extractions'] if 'error' not in e) / results['successful']
-        avg_diaspora = sum(len(e.get('diaspora_locations', []))
-                          for e in results['extractions'] if 'error' not in e) / results['successful']
-
         print(f"\nStats:")
-        print(f"  With explicit coordinates: {coords_count}")
-        print(f"  Avg practice locations: {avg_practice:.1f}")
-        print(f"  Avg diaspora locations: {avg_diaspora:.1f}")
+        print(f"  With explicit coordinates: {stats['coords']}")
+        print(f"  Avg practice locations: {stats['practice'] / results['successful']:.1f}")
+        print(f"  Avg diaspora locations: {stats['diaspora'] / results['successful']:.1f}")
 
 
 if __name__ == "__main__":
@@ -1,20 +1,23 @@
 """
 ICH LLM Extraction - Batch processing for new 2024-25 + gap-fill documents
 Adapted from ich_llm_extract_batch_cd.py
+
+Usage:
+    python ich_llm_extract_new.py           # concurrent synchronous calls
+    python ich_llm_extract_new.py --batch   # Message Batches API
 """
-import sys
-import os
-import json
-import time
+import argparse
 from datetime import datetime
 from pathlib import Path
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
-
 import anthropic
 from dotenv import load_dotenv
 load_dotenv()
 
+from scripts.cdop import llm_cache, llm_client
+from scripts.cdop.extract_checkpoint import ExtractionCheckpoint
+from scripts.shared.rate_limit import RateLimiter
+
 # Input: LLM-cleaned text files
 DOC_DIR = Path('/Users/karlg/Documents/Repos/_cedop/app/data/ich/cleaned_llm')
 
@@ -22,9 +25,34 @@ DOC_DIR = Path('/Users/karlg/Documents/Repos/_cedop/app/data/ich/cleaned_llm')
 OUTPUT_DIR = Path('/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_extractions')
 OUTPUT_FILE = OUTPUT_DIR / 'tier_new_2026-01.json'
 
+# Checkpoint: one extraction per line, appended as each finishes, plus a small
+# sidecar with the run totals. OUTPUT_FILE is assembled from these at the end.
+EXTRACTIONS_FILE = OUTPUT_DIR / 'tier_new_2026-01.jsonl'
+META_FILE = OUTPUT_DIR / 'tier_new_2026-01.meta.json'
+
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-EXTRACTION_PROMPT = """You are a geographic information extraction specialist. Your task is to extract structured location and environmental data from UNESCO Intangible Cultural Heritage nomination documents.
+# --batch mode: the submitted batch ID is kept here until its results are in,
+# so an interrupted run picks up the same batch instead of resubmitting
+BATCH_ID_FILE = OUTPUT_DIR / 'batch_id.txt'
+BATCH_POLL_SECONDS = 60
+
+# Haiku for this bulk gap-fill run, for its lower per-token price; Sonnet
+# stays on the validation sample (ich_llm_extract_sample.py)
+MODEL = "claude-haiku-4-5"
+
+# Bump when SYSTEM_PROMPT/USER_TEMPLATE change, so cached replies to the old prompt are not reused
+PROMPT_VERSION = "v2"
+
+# Concurrent API calls, paced by a shared requests/tokens-per-minute budget
+# (RateLimiter.from_env)
+MAX_WORKERS = 8
+MAX_TOKENS = 4096
+
+# Static instructions + schema, sent as the system prompt; only USER_TEMPLATE
+# varies per document. Not marked for prompt caching: at ~600 tokens it is far
+# below Haiku 4.5's 4096-token minimum cacheable prefix.
+SYSTEM_PROMPT = """You are a geographic information extraction specialist. Your task is to extract structured location and environmental data from UNESCO Intangible Cultural Heritage nomination documents.
 
 IMPORTANT DISTINCTIONS:
 1. **Practice locations**: Where the cultural practice is actually performed/originated. These are the primary geographic footprint.
@@ -32,35 +60,35 @@ IMPORTANT DISTINCTIONS:
 
 EXTRACTION SCHEMA (use this exact structure):
 
-{{
+{
   "ich_id": "string - the 5-digit ID",
   "element_name": "string - name of the cultural element",
 
   "practice_locations": [
-    {{
+    {
       "name": "string - place name",
       "type": "string - one of: country, province, prefecture, county, city, town, village, island, river, mountain, region",
       "parent_admin": "string or null - parent administrative unit",
       "country": "string - ISO country name",
       "country_code": "string or null - 2-letter ISO code if known"
-    }}
+    }
   ],
 
-  "coordinates": {{
+  "coordinates": {
     "explicit": "boolean - true if lat/lon explicitly stated in document",
     "lat_min": "number or null",
     "lat_max": "number or null",
     "lon_min": "number or null",
     "lon_max": "number or null",
     "source_text": "string or null - the exact text containing coordinates"
-  }},
+  },
 
   "diaspora_locations": [
-    {{
+    {
       "name": "string - place name",
       "country": "string - country name",
       "context": "string - brief description of why mentioned (e.g., 'emigrant community', 'spread via trade')"
-    }}
+    }
   ],
 
   "environmental_features": [
@@ -70,7 +98,7 @@ EXTRACTION SCHEMA (use this exact structure):
   "environmental_summary": "string - 1-2 sentence summary of the environmental/geographic context of this practice",
 
   "extraction_notes": "string or null - any ambiguities or issues encountered during extraction"
-}}
+}
 
 GUIDELINES:
 - Be precise about location types (don't call a province a "region")
@@ -78,9 +106,9 @@ GUIDELINES:
 - Only mark coordinates as "explicit" if actual lat/lon values appear in text
 - For diaspora, look for phrases like "emigrants", "migrants", "spread to", "also practiced in [foreign country]"
 - Environmental features should focus on physical geography, not cultural features
-- If uncertain about a classification, note it in extraction_notes
+- If uncertain about a classification, note it in extraction_notes"""
 
-Now extract from this nomination document:
+USER_TEMPLATE = """Now extract from this nomination document:
 
 ---
 DOCUMENT ID: {ich_id}
@@ -98,114 +126,159 @@ def get_files_to_process():
     return files
 
 
-def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic) -> dict:
-    """Call Claude API to extract structured data from document."""
-    prompt = EXTRACTION_PROMPT.format(
-        ich_id=ich_id,
-        document_text=document_text
-    )
-
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        messages=[
-            {"role": "user", "content": prompt}
+def build_request_params(ich_id: str, document_text: str) -> dict:
+    """Messages API parameters for one document (shared by sync and batch modes)."""
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "system": SYSTEM_PROMPT,
+        "messages": [
+            {"role": "user", "content": USER_TEMPLATE.format(ich_id=ich_id, document_text=document_text)}
         ]
-    )
-
-    response_text = message.content[0].text
-
-    # Parse JSON (handle potential markdown code blocks)
-    if response_text.startswith('```'):
-        lines = response_text.split('\n')
-        json_lines = []
-        in_block = False
-        for line in lines:
-            if line.startswith('```'):
-                in_block = not in_block
-                continue
-            if in_block or not line.startswith('```'):
-                json_lines.append(line)
-        response_text = '\n'.join(json_lines)
+    }
+
+
+def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic,
+                        limiter: RateLimiter) -> dict:
+    """Call Claude API to extract structured data from document."""
+    # Byte-identical input to an earlier run: reuse its reply
+    key = llm_cache.cache_key(MODEL, PROMPT_VERSION, ich_id, document_text)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    extraction = llm_client.request_json(client, ich_id, build_request_params(ich_id, document_text), limiter)
+    if "error" not in extraction:
+        llm_cache.set(key, extraction)
+    return extraction
+
+
+def process_doc(doc_path: Path, client: anthropic.Anthropic, limiter: RateLimiter) -> dict:
+    """Read one document and extract it; failures come back as an error record."""
+    ich_id = doc_path.stem.split('_')[0]
+    document_text, lengths = llm_client.read_document(doc_path)
 
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError as e:
-        return {
-            "ich_id": ich_id,
-            "error": f"JSON parse error: {e}",
-            "raw_response": response_text[:500]
-        }
+        extraction = extract_with_claude(ich_id, document_text, client, limiter)
+    except Exception as e:
+        extraction = {"ich_id": ich_id, "error": f"EXCEPTION: {e}"}
+    extraction.update(lengths)
+    return extraction
+
+
+def run_concurrent(client: anthropic.Anthropic, pending: list, checkpoint: ExtractionCheckpoint):
+    """Extract pending documents with synchronous calls on a thread pool."""
+    limiter = RateLimiter.from_env()
+    client = client.with_options(max_retries=0)  # llm_client.create_message does the retrying
+
+    doc_paths = {doc_path.stem.split('_')[0]: doc_path for doc_path in pending}
+    checkpoint.record_concurrent(lambda ich_id: process_doc(doc_paths[ich_id], client, limiter),
+                                 doc_paths, MAX_WORKERS)
+
+
+def run_batch(client: anthropic.Anthropic, pending: list, checkpoint: ExtractionCheckpoint):
+    """Extract pending documents through the Message Batches API (one submission, async pricing)."""
+    resuming = BATCH_ID_FILE.exists()
+    doc_paths = {}
+    keys = {}
+    doc_lengths = {}
+    requests = []
+    for doc_path in pending:
+        ich_id = doc_path.stem.split('_')[0]
+        doc_paths[ich_id] = doc_path
+        document_text, doc_lengths[ich_id] = llm_client.read_document(doc_path)
+        keys[ich_id] = llm_cache.cache_key(MODEL, PROMPT_VERSION, ich_id, document_text)
+        if resuming:
+            continue
+        cached = llm_cache.get(keys[ich_id])
+        if cached is not None:
+            cached.update(doc_lengths[ich_id])
+            checkpoint.record(ich_id, cached)
+            continue
+        requests.append({
+            "custom_id": ich_id,
+            "params": build_request_params(ich_id, document_text),
+        })
+
+    if resuming:
+        batch_id = BATCH_ID_FILE.read_text().strip()
+        print(f"Resuming batch {batch_id}")
+    else:
+        if not requests:
+            return
+        batch = client.messages.batches.create(requests=requests)
+        batch_id = batch.id
+        BATCH_ID_FILE.write_text(batch_id)
+        print(f"Submitted batch {batch_id} ({len(requests)} documents)")
+
+    llm_client.wait_for_batch(client, batch_id, BATCH_POLL_SECONDS)
+
+    # Unparseable replies get the same JSON follow-up turns as the concurrent
+    # path, sent as ordinary synchronous calls
+    sync_client = client.with_options(max_retries=0)
+    limiter = RateLimiter.from_env()
+
+    # Results already checkpointed by an interrupted download are skipped
+    for entry in client.messages.batches.results(batch_id):
+        ich_id = entry.custom_id
+        if ich_id not in keys:
+            continue
+        if entry.result.type == "succeeded":
+            document_text, _ = llm_client.read_document(doc_paths[ich_id])
+            try:
+                extraction = llm_client.request_json(
+                    sync_client, ich_id, build_request_params(ich_id, document_text), limiter,
+                    first_reply=entry.result.message.content[0].text)
+            except Exception as e:
+                extraction = {"ich_id": ich_id, "error": f"EXCEPTION: {e}"}
+            if "error" not in extraction:
+                llm_cache.set(keys[ich_id], extraction)
+        else:
+            extraction = {"ich_id": ich_id, "error": f"Batch request {entry.result.type}"}
+        extraction.update(doc_lengths[ich_id])
+        checkpoint.record(ich_id, extraction)
+
+    checkpoint.save_meta()
+    BATCH_ID_FILE.unlink()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract new and gap-fill nomination documents with Claude')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit via the Message Batches API (slower turnaround, half price)')
+    args = parser.parse_args()
+
     files = get_files_to_process()
     print(f"Found {len(files)} cleaned documents to process")
 
     # Check for existing checkpoint
-    start_idx = 0
     results = {
         "extraction_date": datetime.now().isoformat(),
-        "model": "claude-sonnet-4-20250514",
+        "model": MODEL,
         "source": "new_2024-25_and_gap-fill",
         "total_documents": len(files),
         "successful": 0,
         "failed": 0,
-        "extractions": []
     }
 
-    if OUTPUT_FILE.exists():
-        with open(OUTPUT_FILE, 'r') as f:
-            existing = json.load(f)
-            if existing.get("extractions"):
-                results = existing
-                start_idx = len(existing["extractions"])
-                print(f"Resuming from checkpoint: {start_idx}/{len(files)} already processed")
+    checkpoint = ExtractionCheckpoint(results, OUTPUT_FILE, EXTRACTIONS_FILE, META_FILE)
+
+    # Results arrive in completion order, so resume by ID rather than position
+    done_ids = checkpoint.load()
+    if done_ids:
+        print(f"Resuming from checkpoint: {len(done_ids)}/{len(files)} already processed")
+    pending = [p for p in files if p.stem.split('_')[0] not in done_ids]
 
     client = anthropic.Anthropic()
+    with checkpoint:
+        if args.batch:
+            run_batch(client, pending, checkpoint)
+        else:
+            run_concurrent(client, pending, checkpoint)
 
-    for i, doc_path in enumerate(files[start_idx:], start=start_idx):
-        ich_id = doc_path.stem.split('_')[0]
-        print(f"\n[{i+1}/{len(files)}] Processing {ich_id}...", end=" ", flush=True)
-
-        with open(doc_path, 'r') as f:
-            document_text = f.read()
-
-        try:
-            extraction = extract_with_claude(ich_id, document_text, client)
-
-            if "error" in extraction:
-                print(f"ERROR: {extraction['error'][:50]}")
-                results["failed"] += 1
-            else:
-                n_practice = len(extraction.get('practice_locations', []))
-                n_diaspora = len(extraction.get('diaspora_locations', []))
-                has_coords = extraction.get('coordinates', {}).get('explicit', False)
-                print(f"OK (practice:{n_practice}, diaspora:{n_diaspora}, coords:{has_coords})")
-                results["successful"] += 1
-
-            results["extractions"].append(extraction)
-
-        except Exception as e:
-            print(f"EXCEPTION: {e}")
-            results["extractions"].append({
-                "ich_id": ich_id,
-                "error": str(e)
-            })
-            results["failed"] += 1
-
-        # Small delay to avoid rate limits
-        time.sleep(0.5)
-
-        # Save intermediate results every 10 documents
-        if (i + 1) % 10 == 0:
-            with open(OUTPUT_FILE, 'w') as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
-            print(f"  [Checkpoint saved: {i+1}/{len(files)}]")
-
-    # Final save
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    # Final save: totals sidecar, plus the consolidated single-JSON deliverable
+    checkpoint.save_meta()
+    stats = checkpoint.save_results()
 
     # Summary
     print(f"\n{'='*60}")
@@ -218,17 +291,10 @@ def main():
 
     # Quick stats on successful extractions
     if results['successful'] > 0:
-        coords_count = sum(1 for e in results['extractions']
-                          if e.get('coordinates', {}).get('explicit', False))
-        avg_practice = sum(len(e.get('practice_locations', []))
-                          for e in results['extractions'] if 'error' not in e) / results['successful']
-        avg_diaspora = sum(len(e.get('diaspora_locations', []))
-                          for e in results['extractions'] if 'error' not in e) / results['successful']
-
         print(f"\nStats:")
-        print(f"  With explicit coordinates: {coords_count}")
-        print(f"  Avg practice locations: {avg_practice:.1f}")
-        print(f"  Avg diaspora locations: {avg_diaspora:.1f}")
+        print(f"  With explicit coordinates: {stats['coords']}")
+        print(f"  Avg practice locations: {stats['practice'] / results['successful']:.1f}")
+        print(f"  Avg diaspora locations: {stats['diaspora'] / results['successful']:.1f}")
 
 
 if __name__ == "__main__":
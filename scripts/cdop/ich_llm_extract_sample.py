@@ -1,24 +1,28 @@
 """
 ICH LLM Extraction - Sample Tier D documents
 """
-import sys
-import os
 import json
-import time
 from datetime import datetime
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
-
 import anthropic
 from dotenv import load_dotenv
 load_dotenv()
 
+from scripts.cdop import llm_cache, llm_client
+
 # Tier D sample (random seed=42)
 SAMPLE_IDS = ['00907', '00535', '01294', '01263', '01197', '00998', '00885', '01974', '00870', '01682']
 
 DOC_DIR = '/Users/karlg/Documents/Repos/_cedop/app/data/ich/extracted_clean_02'
 OUTPUT_FILE = '/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_llm_extractions_tier_d_sample.json'
 
+MODEL = "claude-sonnet-4-20250514"
+
+# Bump when EXTRACTION_PROMPT changes, so cached replies to the old prompt are not reused
+PROMPT_VERSION = "v1"
+
+MAX_TOKENS = 4096
+
 EXTRACTION_PROMPT = """You are a geographic information extraction specialist. Your task is to extract structured location and environmental data from UNESCO Intangible Cultural Heritage nomination documents.
 
 IMPORTANT DISTINCTIONS:
@@ -86,85 +90,70 @@ DOCUMENT ID: {ich_id}
 Return ONLY valid JSON matching the schema above. No other text."""
 
 
-def find_doc_path(ich_id: str) -> str | None:
-    for f in os.listdir(DOC_DIR):
-        if f.startswith(ich_id + '_') and f.endswith('.txt'):
-            return os.path.join(DOC_DIR, f)
-    return None
+def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic) -> dict:
+    """Call Claude API to extract structured data from document."""
+    # Byte-identical input to an earlier run: reuse its reply
+    key = llm_cache.cache_key(MODEL, PROMPT_VERSION, ich_id, document_text)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    params = {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "messages": [
+            {"role": "user", "content": EXTRACTION_PROMPT.format(ich_id=ich_id, document_text=document_text)}
+        ]
+    }
+    extraction = llm_client.request_json(client, ich_id, params)
+    if "error" not in extraction:
+        llm_cache.set(key, extraction)
+    return extraction
 
 
-def extract_with_claude(ich_id: str, document_text: str, client: anthropic.Anthropic) -> dict:
-    prompt = EXTRACTION_PROMPT.format(ich_id=ich_id, document_text=document_text)
-
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        messages=[{"role": "user", "content": prompt}]
-    )
-
-    response_text = message.content[0].text
-
-    if response_text.startswith('```'):
-        lines = response_text.split('\n')
-        json_lines = []
-        in_block = False
-        for line in lines:
-            if line.startswith('```'):
-                in_block = not in_block
-                continue
-            if in_block or not line.startswith('```'):
-                json_lines.append(line)
-        response_text = '\n'.join(json_lines)
+def process_doc(ich_id: str, client: anthropic.Anthropic) -> dict:
+    """Read one document and extract it; failures come back as an error record."""
+    doc_path = llm_client.find_doc_path(DOC_DIR, ich_id)
+    if not doc_path:
+        return {"ich_id": ich_id, "error": "Document not found"}
+
+    document_text, lengths = llm_client.read_document(doc_path)
 
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError as e:
-        return {"ich_id": ich_id, "error": f"JSON parse error: {e}", "raw_response": response_text[:500]}
+        extraction = extract_with_claude(ich_id, document_text, client)
+    except Exception as e:
+        extraction = {"ich_id": ich_id, "error": f"EXCEPTION: {e}"}
+    extraction.update(lengths)
+    return extraction
 
 
 def main():
     results = {
         "extraction_date": datetime.now().isoformat(),
-        "model": "claude-sonnet-4-20250514",
+        "model": MODEL,
         "tier": "D (sample)",
         "sample_ids": SAMPLE_IDS,
         "extractions": []
     }
 
-    client = anthropic.Anthropic()
+    # Ten documents, one at a time; llm_client.create_message does the retrying
+    client = anthropic.Anthropic(max_retries=0)
 
     for i, ich_id in enumerate(SAMPLE_IDS):
         print(f"[{i+1}/{len(SAMPLE_IDS)}] Processing {ich_id}...", end=" ", flush=True)
-
-        doc_path = find_doc_path(ich_id)
-        if not doc_path:
-            print("NOT FOUND")
-            results["extractions"].append({"ich_id": ich_id, "error": "Document not found"})
-            continue
-
-        with open(doc_path, 'r') as f:
-            document_text = f.read()
-
-        try:
-            extraction = extract_with_claude(ich_id, document_text, client)
-
-            if "error" in extraction:
-                print(f"ERROR")
-            else:
-                n_practice = len(extraction.get('practice_locations', []))
-                n_diaspora = len(extraction.get('diaspora_locations', []))
-                has_coords = extraction.get('coordinates', {}).get('explicit', False)
-                env_summary = extraction.get('environmental_summary', '')[:50]
-                print(f"practice:{n_practice}, diaspora:{n_diaspora}, coords:{has_coords}")
-                print(f"         env: {env_summary}...")
-
-            results["extractions"].append(extraction)
-
-        except Exception as e:
-            print(f"EXCEPTION: {e}")
-            results["extractions"].append({"ich_id": ich_id, "error": str(e)})
-
-        time.sleep(0.5)
+        extraction = process_doc(ich_id, client)
+
+        if "error" in extraction:
+            print(f"ERROR: {extraction['error'][:50]}")
+        else:
+            n_practice = len(extraction.get('practice_locations', []))
+            n_diaspora = len(extraction.get('diaspora_locations', []))
+            has_coords = extraction.get('coordinates', {}).get('explicit', False)
+            env_summary = extraction.get('environmental_summary', '')[:50]
+            print(f"practice:{n_practice}, diaspora:{n_diaspora}, coords:{has_coords}")
+            print(f"         env: {env_summary}...")
+
+        results["extractions"].append(extraction)
 
     with open(OUTPUT_FILE, 'w') as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
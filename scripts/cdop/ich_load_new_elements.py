@@ -9,11 +9,9 @@ Targets:
 - cdop.ich_elements
 - cdop.ich_summaries
 """
-import sys
 import json
 from pathlib import Path
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 from dotenv import load_dotenv
 load_dotenv(Path('/Users/karlg/Documents/Repos/_cedop/.env'))
 
@@ -48,25 +46,14 @@ def main():
     conn = db_connect(schema='cdop')
     cur = conn.cursor()
 
-    # Check which elements already exist
-    cur.execute("SELECT ich_id FROM ich_elements")
-    existing_ids = {row[0] for row in cur.fetchall()}
-
-    new_count = 0
-    skip_count = 0
+    # Rows for both tables; elements that already exist are skipped by the
+    # server (ON CONFLICT), so there is no client-side existence check
+    element_rows = []
+    summary_rows = {}
 
     for item in summaries:
         ich_id = item['ich_id']
-
-        if ich_id in existing_ids:
-            skip_count += 1
-            continue
-
-        # Insert into ich_elements
-        cur.execute("""
-            INSERT INTO ich_elements (ich_id, label, countries, year, list, link)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
+        element_rows.append((
             ich_id,
             item['title'],
             item['country'],
@@ -74,17 +61,38 @@ def main():
             LIST_MAP.get(item['list_type'], item['list_type']),
             url_lookup.get(ich_id, f"https://ich.unesco.org/en/RL/{ich_id}")
         ))
-
-        # Insert into ich_summaries
-        cur.execute("""
-            INSERT INTO ich_summaries (ich_id, text)
-            VALUES (%s, %s)
-        """, (
-            ich_id,
-            item['summary']
-        ))
-
-        new_count += 1
+        summary_rows[ich_id] = (ich_id, item['summary'])
+
+    # executemany over no rows leaves no result set for fetchone() below
+    if not element_rows:
+        print("No new elements to load.")
+        conn.close()
+        return
+
+    cur.executemany("""
+        INSERT INTO ich_elements (ich_id, label, countries, year, list, link)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (ich_id) DO NOTHING
+        RETURNING ich_id
+    """, element_rows, returning=True)
+
+    # One result set per row: empty when the element already existed
+    new_ids = []
+    while True:
+        row = cur.fetchone()
+        if row:
+            new_ids.append(row[0])
+        if not cur.nextset():
+            break
+
+    # Summaries only for the elements inserted above
+    cur.executemany("""
+        INSERT INTO ich_summaries (ich_id, text)
+        VALUES (%s, %s)
+    """, [summary_rows[ich_id] for ich_id in new_ids])
+
+    new_count = len(new_ids)
+    skip_count = len(element_rows) - new_count
 
     conn.commit()
 
@@ -1,26 +1,38 @@
 """
 Select sample documents for LLM extraction prototype
 """
-import sys
 import os
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
+import re
+from functools import lru_cache
 
 from scripts.shared.db_utils import db_connect
 from psycopg.rows import dict_row
 
+# Case-insensitive search instead of lowercasing a copy of the whole document
+_COORD_RE = re.compile(r'latitude|longitude', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def doc_stats(doc_path: str) -> tuple[int, bool]:
+    """(length in chars, mentions latitude/longitude) for a document, read once per path."""
+    with open(doc_path, 'r') as f:
+        content = f.read()
+    return len(content), _COORD_RE.search(content) is not None
+
 def main():
     conn = db_connect(schema="cdop")
 
     # Get all elements with their concepts
+    # Exact concept matches on primary_concepts_arr
+    # (see sql/cdop/ich_exploration_schema.sql), not substrings of the '; ' list
     query = """
     SELECT ich_id, label, countries, primary_concepts,
            CASE
-             WHEN primary_concepts LIKE '%Mountains%' THEN 'Mountains'
-             WHEN primary_concepts LIKE '%Drylands%' THEN 'Drylands'
-             WHEN primary_concepts LIKE '%Forests%' THEN 'Forests'
-             WHEN primary_concepts LIKE '%Grasslands%' THEN 'Grasslands'
-             WHEN primary_concepts LIKE '%Marine%' THEN 'Marine/coastal'
-             WHEN primary_concepts LIKE '%wetlands%' THEN 'Wetlands'
+             WHEN 'Mountains' = ANY(primary_concepts_arr) THEN 'Mountains'
+             WHEN 'Drylands' = ANY(primary_concepts_arr) THEN 'Drylands'
+             WHEN 'Forests' = ANY(primary_concepts_arr) THEN 'Forests'
+             WHEN 'Grasslands, savannahs' = ANY(primary_concepts_arr) THEN 'Grasslands'
+             WHEN 'Marine, coastal and island areas' = ANY(primary_concepts_arr) THEN 'Marine/coastal'
+             WHEN 'Inland wetlands' = ANY(primary_concepts_arr) THEN 'Wetlands'
              ELSE NULL
            END as env_concept
     FROM cdop.ich_elements
@@ -28,14 +40,14 @@ def main():
     """
 
     doc_dir = '/Users/karlg/Documents/Repos/_cedop/app/data/ich/extracted_clean_02'
-    available_docs = set()
-    for f in os.listdir(doc_dir):
+    # ICH ID -> document path, from one directory listing
+    # (format: 00202_full_text_clean.txt or 01080_extracted_cleaned.txt)
+    doc_index = {}
+    for f in sorted(os.listdir(doc_dir)):
         if f.endswith('.txt'):
-            # Extract ich_id from filename (format: 00202_full_text_clean.txt or 01080_extracted_cleaned.txt)
-            ich_id = f.split('_')[0]
-            available_docs.add(ich_id)
+            doc_index.setdefault(f.split('_')[0], os.path.join(doc_dir, f))
 
-    print(f"Total nomination documents available: {len(available_docs)}")
+    print(f"Total nomination documents available: {len(doc_index)}")
 
     with conn.cursor(row_factory=dict_row) as cur:
         cur.execute(query)
@@ -47,7 +59,7 @@ def main():
     non_env_with_doc = []
 
     for row in rows:
-        has_doc = row['ich_id'] in available_docs
+        has_doc = row['ich_id'] in doc_index
         if row['env_concept']:
             if has_doc:
                 env_with_doc.append(row)
@@ -68,20 +80,13 @@ def main():
 
     coord_docs = []
     for row in env_with_doc:
-        doc_path = None
-        for f in os.listdir(doc_dir):
-            if f.startswith(row['ich_id'] + '_'):
-                doc_path = os.path.join(doc_dir, f)
-                break
-        if doc_path:
-            with open(doc_path, 'r') as f:
-                content = f.read()
-                if 'longitude' in content.lower() or 'latitude' in content.lower():
-                    coord_docs.append((row, len(content)))
-                    if len(coord_docs) <= 5:
-                        print(f"\n[{row['ich_id']}] {row['label'][:50]}")
-                        print(f"  Env: {row['env_concept']}, Countries: {row['countries'][:40]}")
-                        print(f"  Doc length: {len(content)} chars")
+        length, has_coords = doc_stats(doc_index[row['ich_id']])
+        if has_coords:
+            coord_docs.append((row, length))
+            if len(coord_docs) <= 5:
+                print(f"\n[{row['ich_id']}] {row['label'][:50]}")
+                print(f"  Env: {row['env_concept']}, Countries: {row['countries'][:40]}")
+                print(f"  Doc length: {length} chars")
 
     print(f"\n... {len(coord_docs)} total env docs with coordinates")
 
@@ -100,8 +105,9 @@ def main():
 
     # 1 environmental without coordinates
     print("\n--- Environmental without coordinates (1) ---")
+    coord_ids = {r['ich_id'] for r, _ in coord_docs}
     for row in env_with_doc:
-        if row['ich_id'] not in [r['ich_id'] for r, _ in coord_docs]:
+        if row['ich_id'] not in coord_ids:
             sample.append(row['ich_id'])
             print(f"  [{row['ich_id']}] {row['label'][:50]} ({row['env_concept']})")
             break
@@ -110,26 +116,18 @@ def main():
     print("\n--- Non-environmental (2) ---")
     added = 0
     for row in non_env_with_doc:
-        doc_path = None
-        for f in os.listdir(doc_dir):
-            if f.startswith(row['ich_id'] + '_'):
-                doc_path = os.path.join(doc_dir, f)
-                break
-        if doc_path:
-            with open(doc_path, 'r') as f:
-                content = f.read()
-            has_coords = 'longitude' in content.lower() or 'latitude' in content.lower()
-            # Get one with coords, one without
-            if added == 0 and has_coords:
-                sample.append(row['ich_id'])
-                print(f"  [{row['ich_id']}] {row['label'][:50]} (with coords)")
-                added += 1
-            elif added == 1 and not has_coords and len(content) > 5000:
-                sample.append(row['ich_id'])
-                print(f"  [{row['ich_id']}] {row['label'][:50]} (no coords, {len(content)} chars)")
-                added += 1
-            if added >= 2:
-                break
+        length, has_coords = doc_stats(doc_index[row['ich_id']])
+        # Get one with coords, one without
+        if added == 0 and has_coords:
+            sample.append(row['ich_id'])
+            print(f"  [{row['ich_id']}] {row['label'][:50]} (with coords)")
+            added += 1
+        elif added == 1 and not has_coords and length > 5000:
+            sample.append(row['ich_id'])
+            print(f"  [{row['ich_id']}] {row['label'][:50]} (no coords, {length} chars)")
+            added += 1
+        if added >= 2:
+            break
 
     print(f"\n\nFinal sample IDs: {sample}")
 
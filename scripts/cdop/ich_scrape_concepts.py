@@ -8,26 +8,42 @@ This script fetches the landing page for each new element and extracts:
 
 Then updates the ich_elements table with this data.
 """
-import sys
 import re
-import time
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-sys.path.insert(0, '/Users/karlg/Documents/Repos/_cedop')
 from dotenv import load_dotenv
 load_dotenv(Path('/Users/karlg/Documents/Repos/_cedop/.env'))
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from scripts.shared.db_utils import db_connect
+from scripts.shared.rate_limit import RateLimiter
+
+# Optional: selectolax (Lexbor C parser) for fast landing-page parsing;
+# falls back to BeautifulSoup when not installed
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
 
 OUTPUT_DIR = Path('/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_update')
 CACHE_FILE = OUTPUT_DIR / 'concept_scrape_cache.json'
 
+# Concurrent page fetches. Request starts are spaced at least REQUEST_DELAY
+# seconds apart across all workers, so the total rate stays at the polite
+# 1 request/second of the serial scraper; the workers only overlap slow responses.
+MAX_WORKERS = 8
 REQUEST_DELAY = 1.0
 USER_AGENT = "CEDOP-Research-Crawler/1.0 (Academic research; non-commercial)"
 
+# Country state links end in a 2-letter code: /state/country-name-XX
+_STATE_HREF_RE = re.compile(r'/state/.*-[A-Z]{2}$')
+_CC_TAIL_RE = re.compile(r'-([A-Z]{2})$')
+
 
 def get_session():
     """Create a requests session with appropriate headers."""
@@ -37,12 +53,53 @@ def get_session():
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": "en-US,en;q=0.5",
     })
+    # One pooled connection per worker
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     return session
 
 
-def scrape_element_page(session, ich_id: str, url: str) -> dict:
+def _parse_page_fast(html: str, result: dict) -> dict:
+    """selectolax version of the parse in scrape_element_page (same output)."""
+    tree = LexborHTMLParser(html)
+
+    for link in tree.css('a[href*="/state/"]'):
+        href = link.attributes.get('href') or ''
+        if not _STATE_HREF_RE.search(href):
+            continue
+        match = _CC_TAIL_RE.search(href)
+        if match:
+            ccode = match.group(1)
+            if ccode not in result["ccodes"]:
+                result["ccodes"].append(ccode)
+
+    # The first <ol> after the "Concepts" heading, in document order
+    found_heading = False
+    for node in tree.css('h3, ol'):
+        if node.tag == 'h3':
+            if not found_heading and node.text(strip=True) == 'Concepts':
+                found_heading = True
+            continue
+        if found_heading:
+            for link in node.css('a'):
+                cls = (link.attributes.get('class') or '').split()
+                concept_text = link.text(strip=True)
+                if 'link' in cls and concept_text:
+                    if 'primary' in cls:
+                        if concept_text not in result["primary_concepts"]:
+                            result["primary_concepts"].append(concept_text)
+                    elif 'secondary' in cls:
+                        if concept_text not in result["secondary_concepts"]:
+                            result["secondary_concepts"].append(concept_text)
+            break
+
+    return result
+
+
+def scrape_element_page(session, ich_id: str, url: str, limiter: RateLimiter) -> dict:
     """Scrape concepts and country codes from an element's landing page."""
-    time.sleep(REQUEST_DELAY)
+    limiter.acquire()
 
     try:
         response = session.get(url, timeout=30)
@@ -50,8 +107,6 @@ def scrape_element_page(session, ich_id: str, url: str) -> dict:
     except requests.RequestException as e:
         return {"error": str(e)}
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-
     result = {
         "ich_id": ich_id,
         "url": url,
@@ -60,12 +115,17 @@ def scrape_element_page(session, ich_id: str, url: str) -> dict:
         "secondary_concepts": []
     }
 
+    if HAS_SELECTOLAX:
+        return _parse_page_fast(response.text, result)
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
     # Extract country codes from state links
     # Pattern: /state/country-name-XX where XX is the 2-letter code
-    country_links = soup.find_all('a', href=re.compile(r'/state/.*-[A-Z]{2}$'))
+    country_links = soup.find_all('a', href=_STATE_HREF_RE)
     for link in country_links:
         href = link.get('href', '')
-        match = re.search(r'-([A-Z]{2})$', href)
+        match = _CC_TAIL_RE.search(href)
         if match:
             ccode = match.group(1)
             if ccode not in result["ccodes"]:
@@ -118,56 +178,71 @@ def main():
         print(f"Loaded cache with {len(cache)} entries")
 
     session = get_session()
+    # One limiter shared by every worker: the rate is global, not per thread
+    limiter = RateLimiter(60 / REQUEST_DELAY, burst=1)
     results = []
 
-    for i, (ich_id, link, countries) in enumerate(elements):
+    to_scrape = []
+    for ich_id, link, countries in elements:
         if ich_id in cache:
-            print(f"[{i+1}/{len(elements)}] {ich_id}: cached")
             results.append(cache[ich_id])
-            continue
-
-        print(f"[{i+1}/{len(elements)}] {ich_id}: scraping...", end=" ", flush=True)
-
-        result = scrape_element_page(session, ich_id, link)
-
-        if "error" in result:
-            print(f"ERROR: {result['error']}")
         else:
-            print(f"OK (ccodes:{result['ccodes']}, pri:{len(result['primary_concepts'])}, sec:{len(result['secondary_concepts'])})")
-
-        results.append(result)
-        cache[ich_id] = result
-
-        # Save cache periodically
-        if (i + 1) % 10 == 0:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(cache, f, indent=2)
-            print(f"  [Cache saved: {i+1}/{len(elements)}]")
+            to_scrape.append((ich_id, link))
+    print(f"{len(results)} cached, {len(to_scrape)} to scrape")
+
+    # Workers only fetch and parse; results and the cache stay on this thread
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {pool.submit(scrape_element_page, session, ich_id, link, limiter): ich_id
+                   for ich_id, link in to_scrape}
+        for i, future in enumerate(as_completed(futures)):
+            ich_id = futures[future]
+            result = future.result()
+            print(f"[{i+1}/{len(to_scrape)}] {ich_id}:", end=" ")
+
+            if "error" in result:
+                print(f"ERROR: {result['error']}")
+            else:
+                print(f"OK (ccodes:{result['ccodes']}, pri:{len(result['primary_concepts'])}, sec:{len(result['secondary_concepts'])})")
+
+            results.append(result)
+            cache[ich_id] = result
+
+            # Save cache periodically
+            if (i + 1) % 10 == 0:
+                with open(CACHE_FILE, 'w') as f:
+                    json.dump(cache, f, indent=2)
+                print(f"  [Cache saved: {i+1}/{len(to_scrape)}]")
 
     # Save final cache
     with open(CACHE_FILE, 'w') as f:
         json.dump(cache, f, indent=2)
 
-    # Update database
+    # Update database: all rows in one UPDATE ... FROM (VALUES ...)
     print("\nUpdating database...")
-    updated = 0
+    rows = []
     for result in results:
         if "error" in result:
             continue
 
-        ich_id = result["ich_id"]
-        ccodes = result["ccodes"] if result["ccodes"] else None
-        primary = "; ".join(result["primary_concepts"]) if result["primary_concepts"] else None
-        secondary = "; ".join(result["secondary_concepts"]) if result["secondary_concepts"] else None
-
-        cur.execute("""
-            UPDATE ich_elements
-            SET ccodes = %s,
-                primary_concepts = %s,
-                secondary_concepts = %s
-            WHERE ich_id = %s
-        """, (ccodes, primary, secondary, ich_id))
-        updated += 1
+        rows.append((
+            result["ich_id"],
+            result["ccodes"] if result["ccodes"] else None,
+            "; ".join(result["primary_concepts"]) if result["primary_concepts"] else None,
+            "; ".join(result["secondary_concepts"]) if result["secondary_concepts"] else None,
+        ))
+
+    updated = 0
+    if rows:
+        values = ", ".join(["(%s, %s::text[], %s, %s)"] * len(rows))
+        cur.execute(f"""
+            UPDATE ich_elements AS e
+            SET ccodes = v.ccodes,
+                primary_concepts = v.primary_concepts,
+                secondary_concepts = v.secondary_concepts
+            FROM (VALUES {values}) AS v(ich_id, ccodes, primary_concepts, secondary_concepts)
+            WHERE e.ich_id = v.ich_id
+        """, [param for row in rows for param in row])
+        updated = cur.rowcount
 
     conn.commit()
 
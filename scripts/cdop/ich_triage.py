@@ -5,6 +5,31 @@ Quick quality assessment of nomination documents without LLM calls
 import os
 import re
 import json
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+# Optional: pyahocorasick for a single-pass scan of the place-indicator
+# keywords; falls back to the regexes alone when not installed
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+# Optional: hyperscan (or its Vectorscan build) to run the coordinate and
+# geo-section presence checks in one native scan; Python re otherwise
+try:
+    import hyperscan
+    HAS_HYPERSCAN = True
+except ImportError:
+    HAS_HYPERSCAN = False
+
+# Optional: orjson for a faster dump of the triage results; stdlib json otherwise
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 DOC_DIR = '/Users/karlg/Documents/Repos/_cedop/app/data/ich/extracted_clean_02'
 OUTPUT_FILE = '/Users/karlg/Documents/Repos/_cedop/output/cdop/ich_triage.json'
@@ -19,40 +44,174 @@ COORD_PATTERNS = [
     r'\d+°.*latitude',             # 25° north latitude
 ]
 
+# Section headings marking a Geographic location section
+GEO_SECTION_HEADINGS = [
+    'geographic location',
+    'location and range',
+    'geographical scope',
+]
+
+# Patterns for specific place mentions
+PLACE_INDICATORS = [
+    r'\b[A-Z][a-z]+ (?:Province|County|District|Prefecture|City|Town|Village|Island|Region)\b',
+    r'\b(?:Province|County|District|Prefecture) of [A-Z][a-z]+\b',
+    r'\bkm\s*(?:from|north|south|east|west)\b',
+    r'\bsquare\s*(?:km|kilometer|kilometre)\b',
+]
+
+# Compiled once at import; these run over every document.
+# The coordinate patterns are only tested for presence, so they are fused into
+# one alternation and the text is scanned once instead of once per pattern.
+COORD_ANY = re.compile('|'.join(f'(?:{p})' for p in COORD_PATTERNS), re.IGNORECASE)
+# Case-insensitive search instead of lowercasing a copy of the whole document
+GEO_RE = re.compile('|'.join(map(re.escape, GEO_SECTION_HEADINGS)), re.IGNORECASE)
+PLACE_RES = [re.compile(p, re.IGNORECASE) for p in PLACE_INDICATORS]
+
+if HAS_HYPERSCAN:
+    # One database for both presence checks: ids below len(COORD_PATTERNS) are
+    # coordinate patterns, the rest geo-section headings. UTF8|UCP gives \d, \s
+    # and case folding their Unicode meaning, as in the str regexes above, and
+    # SINGLEMATCH reports each pattern at most once per document.
+    HS_EXPRESSIONS = COORD_PATTERNS + GEO_SECTION_HEADINGS
+    HS_DB = hyperscan.Database()
+    HS_DB.compile(
+        expressions=[p.encode('utf-8') for p in HS_EXPRESSIONS],
+        ids=list(range(len(HS_EXPRESSIONS))),
+        elements=len(HS_EXPRESSIONS),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 |
+               hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH] * len(HS_EXPRESSIONS),
+    )
+
+# Document length buckets: BUCKET_LABELS[bisect_right(BUCKET_EDGES, length)]
+BUCKET_EDGES = [3000, 5000, 10000, 15000]
+BUCKET_LABELS = ["<3000", "3000-5000", "5000-10000", "10000-15000", ">15000"]
+
+# Keywords anchoring the first two PLACE_INDICATORS: "<Name> <suffix>" and
+# "<prefix> of <Name>"
+PLACE_SUFFIXES = ['province', 'county', 'district', 'prefecture', 'city', 'town', 'village', 'island', 'region']
+PLACE_PREFIXES = ['province', 'county', 'district', 'prefecture']
+
+if HAS_AHOCORASICK:
+    PLACE_AUTOMATON = ahocorasick.Automaton()
+    for word in PLACE_SUFFIXES:
+        PLACE_AUTOMATON.add_word(word, (len(word), word in PLACE_PREFIXES))
+    PLACE_AUTOMATON.make_automaton()
+
 def has_coordinates(text: str) -> bool:
     """Check if document contains explicit coordinates."""
-    text_lower = text.lower()
-    for pattern in COORD_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    return False
+    return COORD_ANY.search(text) is not None
 
 def has_geo_section(text: str) -> bool:
     """Check if document has a Geographic location section."""
-    patterns = [
-        r'geographic location',
-        r'location and range',
-        r'geographical scope',
-    ]
-    text_lower = text.lower()
-    return any(p in text_lower for p in patterns)
+    return GEO_RE.search(text) is not None
+
+def scan_presence(text: str) -> tuple[bool, bool]:
+    """has_coordinates and has_geo_section from a single Hyperscan pass."""
+    found = [False, False]
+
+    def on_match(pattern_id, start, end, flags, context):
+        found[pattern_id >= len(COORD_PATTERNS)] = True
+
+    # Re-encoding a str decoded with 'replace' always gives valid UTF-8, which
+    # the UTF8-mode database requires
+    HS_DB.scan(text.encode('utf-8'), match_event_handler=on_match)
+    return found[0], found[1]
+
+# Documents are scanned as decoded str, not as mmap'd bytes: the patterns rely
+# on Unicode \d, \s, \b and case folding, '°' and '′' are multi-byte in UTF-8,
+# and "length" counts characters, so a bytes-mode scan would change the triage.
+# Nominations are at most tens of KB, which one read() handles without strain.
+def read_text(path: str) -> str:
+    """Read a document as UTF-8 in one unbuffered read, skipping the text-mode wrapper."""
+    with open(path, 'rb', buffering=0) as f:
+        data = f.read()
+    # Keep the universal-newline translation text mode would have applied
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data.decode('utf-8', 'replace')
 
 def extract_ich_id(filename: str) -> str:
     """Extract ICH ID from filename."""
     return filename.split('_')[0]
 
+def _count_anchored_places(text: str) -> tuple[int, int] | None:
+    """
+    Match counts for the first two PLACE_INDICATORS, found from one keyword scan.
+
+    Each keyword hit is confirmed with the pattern's own regex at the position
+    the match would have to start, and matches overlapping the previous one are
+    skipped, so the counts equal len(findall(...)) for each pattern. Returns
+    None when lowercasing changes the text length (keyword offsets would not
+    line up with the original text).
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return None
+    name_suffix, prefix_of_name = PLACE_RES[0], PLACE_RES[1]
+    n_suffix = n_prefix = 0
+    suffix_end = prefix_end = 0
+    for end, (length, is_prefix) in PLACE_AUTOMATON.iter(lowered):
+        start = end + 1 - length
+        # "<Name> <suffix>": the match starts at the word before the single space
+        if start >= 2 and text[start - 1] == ' ':
+            i = start - 1
+            while i > 0 and (text[i - 1].isalnum() or text[i - 1] == '_'):
+                i -= 1
+            if i >= suffix_end:
+                m = name_suffix.match(text, i)
+                if m and m.end() == end + 1:
+                    n_suffix += 1
+                    suffix_end = m.end()
+        # "<prefix> of <Name>": the match starts at the keyword itself
+        if is_prefix and start >= prefix_end:
+            m = prefix_of_name.match(text, start)
+            if m:
+                n_prefix += 1
+                prefix_end = m.end()
+    return n_suffix, n_prefix
+
 def count_place_indicators(text: str) -> int:
     """Count indicators of specific place mentions."""
-    indicators = [
-        r'\b[A-Z][a-z]+ (?:Province|County|District|Prefecture|City|Town|Village|Island|Region)\b',
-        r'\b(?:Province|County|District|Prefecture) of [A-Z][a-z]+\b',
-        r'\bkm\s*(?:from|north|south|east|west)\b',
-        r'\bsquare\s*(?:km|kilometer|kilometre)\b',
-    ]
-    count = 0
-    for pattern in indicators:
-        count += len(re.findall(pattern, text, re.IGNORECASE))
-    return count
+    # Patterns are counted separately: their matches can overlap (e.g.
+    # "Yunnan Province of China"), which one alternation would count only once
+    if HAS_AHOCORASICK:
+        anchored = _count_anchored_places(text)
+        if anchored is not None:
+            return sum(anchored) + sum(len(r.findall(text)) for r in PLACE_RES[2:])
+    return sum(len(r.findall(text)) for r in PLACE_RES)
+
+def classify(path: str) -> dict:
+    """Read one document and assign its quality tier."""
+    text = read_text(path)
+    filename = os.path.basename(path)
+    length = len(text)
+
+    if HAS_HYPERSCAN:
+        has_coords, has_geo = scan_presence(text)
+    else:
+        has_coords = has_coordinates(text)
+        has_geo = has_geo_section(text)
+    place_count = count_place_indicators(text)
+
+    # Determine tier
+    if has_coords:
+        tier = "A"
+    elif has_geo:
+        tier = "B"
+    elif length > 5000 and place_count >= 3:
+        tier = "C"
+    else:
+        tier = "D"
+
+    return {
+        "ich_id": extract_ich_id(filename),
+        "filename": filename,
+        "length": length,
+        "has_coordinates": has_coords,
+        "has_geo_section": has_geo,
+        "place_indicators": place_count,
+        "tier": tier,
+    }
 
 def main():
     results = {
@@ -68,73 +227,35 @@ def main():
             "avg_length": 0,
             "min_length": float('inf'),
             "max_length": 0,
-            "length_buckets": {
-                "<3000": 0,
-                "3000-5000": 0,
-                "5000-10000": 0,
-                "10000-15000": 0,
-                ">15000": 0,
-            }
+            "length_buckets": {label: 0 for label in BUCKET_LABELS}
         },
         "documents": []
     }
 
     all_lengths = []
 
-    for filename in sorted(os.listdir(DOC_DIR)):
-        if not filename.endswith('.txt'):
-            continue
+    with os.scandir(DOC_DIR) as it:
+        entries = sorted((e for e in it if e.name.endswith('.txt') and e.is_file()),
+                         key=lambda e: e.name)
 
-        filepath = os.path.join(DOC_DIR, filename)
-        with open(filepath, 'r') as f:
-            text = f.read()
+    # Documents are classified independently, so spread them over all cores;
+    # map() keeps results in filename order
+    with ProcessPoolExecutor() as ex:
+        for doc_info in ex.map(classify, [e.path for e in entries], chunksize=32):
+            ich_id = doc_info["ich_id"]
+            tier = doc_info["tier"]
+            length = doc_info["length"]
+            all_lengths.append(length)
 
-        ich_id = extract_ich_id(filename)
-        length = len(text)
-        all_lengths.append(length)
+            results["documents"].append(doc_info)
+            results["tiers"][tier]["count"] += 1
+            results["tiers"][tier]["docs"].append(ich_id)
 
-        has_coords = has_coordinates(text)
-        has_geo = has_geo_section(text)
-        place_count = count_place_indicators(text)
-
-        # Determine tier
-        if has_coords:
-            tier = "A"
-        elif has_geo:
-            tier = "B"
-        elif length > 5000 and place_count >= 3:
-            tier = "C"
-        else:
-            tier = "D"
-
-        doc_info = {
-            "ich_id": ich_id,
-            "filename": filename,
-            "length": length,
-            "has_coordinates": has_coords,
-            "has_geo_section": has_geo,
-            "place_indicators": place_count,
-            "tier": tier,
-        }
-
-        results["documents"].append(doc_info)
-        results["tiers"][tier]["count"] += 1
-        results["tiers"][tier]["docs"].append(ich_id)
-
-        # Update length buckets
-        if length < 3000:
-            results["stats"]["length_buckets"]["<3000"] += 1
-        elif length < 5000:
-            results["stats"]["length_buckets"]["3000-5000"] += 1
-        elif length < 10000:
-            results["stats"]["length_buckets"]["5000-10000"] += 1
-        elif length < 15000:
-            results["stats"]["length_buckets"]["10000-15000"] += 1
-        else:
-            results["stats"]["length_buckets"][">15000"] += 1
+            # Update length buckets
+            results["stats"]["length_buckets"][BUCKET_LABELS[bisect_right(BUCKET_EDGES, length)]] += 1
 
-        results["stats"]["min_length"] = min(results["stats"]["min_length"], length)
-        results["stats"]["max_length"] = max(results["stats"]["max_length"], length)
+            results["stats"]["min_length"] = min(results["stats"]["min_length"], length)
+            results["stats"]["max_length"] = max(results["stats"]["max_length"], length)
 
     results["total_documents"] = len(all_lengths)
     results["stats"]["avg_length"] = int(sum(all_lengths) / len(all_lengths))
@@ -167,8 +288,12 @@ def main():
             print(f"  Sample IDs: {info['docs'][:5]}...")
 
     # Save full results
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(results, f, indent=2)
+    if HAS_ORJSON:
+        with open(OUTPUT_FILE, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    else:
+        with open(OUTPUT_FILE, 'w') as f:
+            json.dump(results, f, indent=2)
 
     print(f"\n" + "="*60)
     print(f"Full results saved to: {OUTPUT_FILE}")
@@ -0,0 +1,40 @@
+"""
+On-disk cache of LLM extraction results, keyed by a hash of everything that
+determines the reply (model, prompt version, document ID and text).
+
+Entries live at CACHE_DIR/{key[:2]}/{key}.json, one file per call.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+
+CACHE_DIR = Path('/Users/karlg/Documents/Repos/_cedop/output/cdop/llm_cache')
+
+
+def cache_key(*parts: str) -> str:
+    """SHA-256 hex digest of the NUL-joined parts."""
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _path(key: str) -> Path:
+    return CACHE_DIR / key[:2] / f'{key}.json'
+
+
+def get(key: str) -> dict | None:
+    """Return the cached value for key, or None on a miss."""
+    try:
+        with open(_path(key), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def set(key: str, value: dict):
+    """Store value under key (written to a temp file, then renamed into place)."""
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp, path)
@@ -0,0 +1,179 @@
+"""
+Messages API helpers shared by the ICH extraction scripts
+(ich_llm_extract_new.py, ich_llm_extract_sample.py, ich_llm_extract_batch_cd.py):
+document lookup and truncation, retries for transient API errors, JSON
+replies with follow-up turns when a reply does not parse, and waiting on a
+Message Batch.
+"""
+import os
+import re
+import json
+import random
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import anthropic
+
+from scripts.shared.json_io import json_loads
+
+# Retries for rate-limit/overload/server/connection errors. Callers turn the
+# SDK's own retries off (max_retries=0) so these are the only ones.
+API_RETRIES = 5
+
+# Without a retry-after header, wait between half and all of
+# RETRY_BASE_DELAY * 2**attempt seconds, capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
+# Follow-up attempts when a reply does not parse as JSON
+JSON_RETRIES = 2
+
+# A reply wrapped in a markdown code fence (```json ... ```)
+_FENCE_RE = re.compile(r'^```(?:json)?\s*\n(.*?)\n```\s*$', re.DOTALL)
+
+# Longer documents are cut to their first MAX_INPUT_CHARS - TAIL_CHARS and
+# last TAIL_CHARS characters (~10K tokens) before sending
+MAX_INPUT_CHARS = 40000
+TAIL_CHARS = 10000
+
+
+@lru_cache(maxsize=None)
+def doc_index(doc_dir: str) -> dict:
+    """Map ICH ID -> document path, from a single listing of doc_dir."""
+    index = {}
+    for f in sorted(os.listdir(doc_dir)):
+        if f.endswith('.txt') and '_' in f:
+            index.setdefault(f.split('_', 1)[0], os.path.join(doc_dir, f))
+    return index
+
+
+def find_doc_path(doc_dir: str, ich_id: str) -> str | None:
+    """Find the document file for a given ICH ID in doc_dir."""
+    return doc_index(doc_dir).get(ich_id)
+
+
+def truncate_document(document_text: str, max_chars: int = MAX_INPUT_CHARS,
+                      tail_chars: int = TAIL_CHARS) -> str:
+    """Cap a document at max_chars, keeping its head and its last tail_chars."""
+    if len(document_text) <= max_chars:
+        return document_text
+    head = max_chars - tail_chars
+    return document_text[:head] + "\n...[truncated]...\n" + document_text[-tail_chars:]
+
+
+def read_document(doc_path, truncate=truncate_document) -> tuple[str, dict]:
+    """Read a document and truncate it for the prompt; also return its before/after lengths.
+
+    truncate is the script's cut policy (head + tail by default).
+    """
+    with open(doc_path, 'r') as f:
+        document_text = f.read()
+    sent_text = truncate(document_text)
+    return sent_text, {"original_len": len(document_text), "sent_len": len(sent_text)}
+
+
+def strip_code_fence(response_text: str) -> str:
+    """Drop a markdown code fence (```json ... ```) around a JSON reply."""
+    m = _FENCE_RE.match(response_text)
+    return m.group(1) if m else response_text
+
+
+def is_retryable(e: Exception) -> bool:
+    """True for errors worth retrying: rate limits, overload, 5xx and connection failures."""
+    return (isinstance(e, (anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError))
+            or (isinstance(e, anthropic.APIStatusError) and e.status_code in (429, 500, 502, 503, 529)))
+
+
+def retry_delay(e: Exception, attempt: int) -> float:
+    """Seconds to wait before retry number attempt + 1.
+
+    The server's retry-after header when present, otherwise exponential
+    backoff with jitter, so parallel workers do not retry in lockstep.
+    """
+    response = getattr(e, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def create_message(client: anthropic.Anthropic, **params):
+    """client.messages.create, retrying transient API errors up to API_RETRIES times."""
+    for attempt in range(API_RETRIES + 1):
+        try:
+            return client.messages.create(**params)
+        except Exception as e:
+            if attempt == API_RETRIES or not is_retryable(e):
+                raise
+            time.sleep(retry_delay(e, attempt))
+
+
+def estimate_tokens(params: dict, messages: list) -> int:
+    """Rough token cost of a request for rate limiting: ~4 chars per input token, plus max_tokens."""
+    system = params.get("system", "")
+    if not isinstance(system, str):
+        system = ''.join(block["text"] for block in system)
+    return (len(system) + sum(len(m["content"]) for m in messages)) // 4 + params["max_tokens"]
+
+
+def add_usage(usage: dict, message_usage):
+    """Add a reply's input/output token counts to the running totals in usage."""
+    usage["input_tokens"] = usage.get("input_tokens", 0) + message_usage.input_tokens
+    usage["output_tokens"] = usage.get("output_tokens", 0) + message_usage.output_tokens
+
+
+def request_json(client: anthropic.Anthropic, ich_id: str, params: dict, limiter=None,
+                 first_reply: str | None = None, usage: dict | None = None) -> dict:
+    """Send a Messages API request and parse the reply as JSON.
+
+    A reply that is not valid JSON is sent back with the parse error, keeping
+    the conversation, up to JSON_RETRIES times; after that an error record
+    (with the start of the raw reply) is returned instead. first_reply is a
+    reply already in hand for params (e.g. from a message batch); it is parsed
+    first and only the follow-ups are sent. limiter, if given, is a
+    scripts.shared.rate_limit.RateLimiter acquired before each call. usage, if
+    given, has the input/output token counts of the calls made added to it.
+    """
+    messages = list(params["messages"])
+    response_text = first_reply
+    for attempt in range(JSON_RETRIES + 1):
+        if response_text is None:
+            if limiter is not None:
+                limiter.acquire(estimate_tokens(params, messages))
+            message = create_message(client, **{**params, "messages": messages})
+            response_text = message.content[0].text
+            if usage is not None:
+                add_usage(usage, message.usage)
+
+        try:
+            return json_loads(strip_code_fence(response_text))
+        except json.JSONDecodeError as e:  # orjson.JSONDecodeError subclasses this
+            if attempt == JSON_RETRIES:
+                return {
+                    "ich_id": ich_id,
+                    "error": f"JSON parse error: {e}",
+                    "raw_response": response_text[:500]
+                }
+            messages += [
+                {"role": "assistant", "content": response_text},
+                {"role": "user", "content": f"Your previous output failed JSON parsing: {e}. "
+                                            "Return only valid JSON matching the schema."},
+            ]
+            response_text = None
+
+
+def wait_for_batch(client: anthropic.Anthropic, batch_id: str, poll_seconds: float):
+    """Poll a Message Batch until it has ended, printing its request counts meanwhile."""
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            return batch
+        counts = batch.request_counts
+        print(f"  [{datetime.now():%H:%M:%S}] {batch.processing_status}: "
+              f"{counts.processing} processing, {counts.succeeded} succeeded, {counts.errored} errored")
+        time.sleep(poll_seconds)
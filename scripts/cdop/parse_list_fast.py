@@ -0,0 +1,123 @@
+"""
+Typed parser for the UNESCO ICH lists page.
+
+Split out of ich_corpus_update.py so it can be compiled ahead of time with
+mypyc (the function is pure: no I/O, stable signature):
+
+    pip install -e '.[build]'                # mypy (provides mypyc), lxml-stubs
+    mypyc scripts/cdop/parse_list_fast.py    # from the project root
+
+The compiled extension (parse_list_fast.*.so) shadows this file on import;
+without it the pure-Python module is used unchanged.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+from lxml import html as lxml_html  # type: ignore[import-untyped,unused-ignore]
+
+# Recovering parser: tolerates the malformed markup of saved/view-source pages
+LIST_PARSER = lxml_html.HTMLParser(recover=True, remove_comments=True)
+
+_YEAR_ID_RE = re.compile(r'^\d{4}$')
+_ELEMENT_HREF_RE = re.compile(r'/en/(RL|USL|BSP)/')
+
+# List-type header substring -> list code (checked in order)
+_LISTTYPE_MAP: Dict[str, str] = {
+    'Urgent Safeguarding': 'USL',
+    'Representative': 'RL',
+    'Good Safeguarding': 'BSP',
+    'Best': 'BSP',
+}
+
+
+def _join(node: Any) -> str:
+    """Concatenate stripped text fragments of a node (like BS4 get_text(strip=True))."""
+    return ''.join(t.strip() for t in node.itertext())
+
+
+def _extract_row(row: Any, base_url: str, current_year: Optional[str],
+                 current_list_type: Optional[str]) -> Optional[Dict[str, Optional[str]]]:
+    """Return the element dict for a list-element table row, or None."""
+    cells: List[Any] = [td for td in row.iter('td')
+                        if 'list-element' in td.get('class', '').split()]
+    if len(cells) < 2:
+        return None
+
+    # First cell has the element link
+    link: Any = None
+    for a in cells[0].iter('a'):
+        if _ELEMENT_HREF_RE.search(a.get('href', '')):
+            link = a
+            break
+    if link is None:
+        return None
+
+    href: str = link.get('href', '')
+
+    # Extract list type from URL if not already set
+    url_match = _ELEMENT_HREF_RE.search(href)
+    list_type = url_match.group(1) if url_match else current_list_type
+
+    return {
+        'ich_id': link.get('title', ''),
+        'name': _join(link),
+        'url': urljoin(base_url, href.split('#')[0]),  # Remove fragment
+        'list_type': list_type,
+        'country': _join(cells[1]),  # Second cell has country
+        'year': current_year,
+    }
+
+
+def parse_list_page(html_content: Any, base_url: str) -> List[Dict[str, Optional[str]]]:
+    """
+    Parse the ICH lists page to extract all inscribed elements.
+
+    Accepts either raw HTML (str/bytes) or an already-parsed lxml tree.
+
+    Returns list of dicts with:
+    - ich_id: 5-digit ID (e.g., "02329")
+    - name: Element name
+    - url: Full URL to element page
+    - list_type: RL (Representative), USL (Urgent), BSP (Best Practice)
+    - country: Country name(s)
+    - year: Inscription year
+    """
+    if isinstance(html_content, (str, bytes)):
+        tree: Any = lxml_html.fromstring(html_content, parser=LIST_PARSER)
+    else:
+        tree = html_content
+    elements: List[Dict[str, Optional[str]]] = []
+    current_year: Optional[str] = None
+    current_list_type: Optional[str] = None
+
+    # The page structure has year headers and list type subheaders
+    # followed by table rows with elements
+    for row in tree.iter('tr'):
+        ths: List[Any] = list(row.iter('th'))
+
+        # Check for year header (th with id like "2025")
+        year_id: Optional[str] = None
+        for th in ths:
+            th_id: str = th.get('id', '')
+            if _YEAR_ID_RE.match(th_id):
+                year_id = th_id
+                break
+        if year_id is not None:
+            current_year = year_id
+            continue
+
+        # Check for list type header
+        if ths:
+            header_text = ' '.join(t.strip() for t in ths[0].itertext() if t.strip())
+            list_type = next((v for k, v in _LISTTYPE_MAP.items() if k in header_text), None)
+            if list_type is not None:
+                current_list_type = list_type
+            continue
+
+        element = _extract_row(row, base_url, current_year, current_list_type)
+        if element is not None:
+            elements.append(element)
+
+    return elements
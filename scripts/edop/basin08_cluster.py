@@ -10,17 +10,24 @@ Usage:
 
 import os
 import numpy as np
-import pandas as pd
 import psycopg
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from dotenv import load_dotenv
 
+# Optional: faiss for multi-threaded (or GPU) k-means; sklearn MiniBatchKMeans otherwise
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
 load_dotenv()
 
 # Configuration
 N_CLUSTERS = 20
 RANDOM_STATE = 42
+FETCH_ROWS = 50000  # rows per server-side cursor fetch
 
 # Basin08 columns mapped to bands A-D
 # These are the raw column names in basin08
@@ -89,47 +96,70 @@ def get_db_connection():
 
 
 def load_basin_features(conn):
-    """Load feature columns from basin08."""
+    """
+    Load feature columns from basin08.
+
+    Streams rows through a server-side cursor straight into a preallocated
+    float32 array (NULL -> NaN), columns ordered numerical, PNV, categorical.
+    Returns (basin_ids, values).
+    """
 
     # Build column list
     num_cols = list(NUMERICAL_COLUMNS.keys())
     cat_cols = list(CATEGORICAL_COLUMNS.keys())
-    all_cols = ['id'] + num_cols + PNV_COLUMNS + cat_cols
+    feature_cols = num_cols + PNV_COLUMNS + cat_cols
 
-    col_str = ', '.join(all_cols)
+    col_str = ', '.join(['id'] + feature_cols)
 
-    print(f"Loading {len(all_cols)} columns from basin08...")
+    print(f"Loading {len(feature_cols) + 1} columns from basin08...")
 
-    df = pd.read_sql(
-        f"SELECT {col_str} FROM basin08 ORDER BY id",
-        conn
-    )
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM basin08")
+        n_rows = cur.fetchone()[0]
+
+    basin_ids = np.empty(n_rows, dtype=np.int64)
+    values = np.empty((n_rows, len(feature_cols)), dtype=np.float32)
+
+    n = 0
+    with conn.cursor(name="basin_stream") as cur:
+        cur.itersize = FETCH_ROWS
+        cur.execute(f"SELECT {col_str} FROM basin08 ORDER BY id")
+        while rows := cur.fetchmany(FETCH_ROWS):
+            chunk = np.array(rows, dtype=np.float64)
+            basin_ids[n:n + len(rows)] = chunk[:, 0]
+            values[n:n + len(rows)] = chunk[:, 1:]
+            n += len(rows)
 
-    print(f"Loaded {len(df):,} basins")
-    return df
+    print(f"Loaded {n:,} basins")
+    return basin_ids[:n], values[:n]
 
 
-def prepare_features(df):
+def prepare_features(values):
     """Prepare feature matrix for clustering."""
 
+    n_num = len(NUMERICAL_COLUMNS)
+    n_pnv = len(PNV_COLUMNS)
+
     # Numerical columns
-    num_cols = list(NUMERICAL_COLUMNS.keys())
-    X_num = df[num_cols].values.astype(float)
+    X_num = values[:, :n_num]
 
     # PNV share columns (already percentages 0-100)
-    X_pnv = df[PNV_COLUMNS].values.astype(float)
+    X_pnv = values[:, n_num:n_num + n_pnv]
 
-    # Categorical columns - one-hot encode
-    cat_cols = list(CATEGORICAL_COLUMNS.keys())
+    # Categorical columns - one-hot encode: one column per sorted class value,
+    # plus a trailing column for NULL
     X_cat_list = []
-    for col in cat_cols:
-        dummies = pd.get_dummies(df[col], prefix=col, dummy_na=True)
-        X_cat_list.append(dummies.values)
+    for j in range(len(CATEGORICAL_COLUMNS)):
+        col = values[:, n_num + n_pnv + j]
+        missing = np.isnan(col)
+        classes = np.unique(col[~missing])
+        codes = np.where(missing, len(classes), np.searchsorted(classes, col))
+        X_cat_list.append(np.eye(len(classes) + 1, dtype=np.float32)[codes])
 
     if X_cat_list:
         X_cat = np.hstack(X_cat_list)
     else:
-        X_cat = np.empty((len(df), 0))
+        X_cat = np.empty((len(values), 0), dtype=np.float32)
 
     # Combine all features
     X = np.hstack([X_num, X_pnv, X_cat])
@@ -154,20 +184,42 @@ def prepare_features(df):
 
 
 def cluster_basins(X, n_clusters=N_CLUSTERS):
-    """Run MiniBatch K-means clustering."""
-
-    print(f"Running MiniBatch K-means with k={n_clusters}...")
+    """Run K-means clustering (faiss when installed, else MiniBatch K-means)."""
+
+    if HAS_FAISS:
+        use_gpu = faiss.get_num_gpus() > 0
+        print(f"Running faiss K-means with k={n_clusters} ({'GPU' if use_gpu else 'CPU'})...")
+
+        # faiss wants contiguous float32; full-batch Lloyd iterations with
+        # 10 restarts, training on every basin rather than faiss's default
+        # subsample of 256 points per centroid
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        kmeans = faiss.Kmeans(
+            X.shape[1],
+            n_clusters,
+            niter=50,
+            nredo=10,
+            seed=RANDOM_STATE,
+            max_points_per_centroid=len(X),
+            gpu=use_gpu,
+            verbose=True,
+        )
+        kmeans.train(X)
+        _, labels = kmeans.index.search(X, 1)
+        labels = labels.ravel()
+    else:
+        print(f"Running MiniBatch K-means with k={n_clusters}...")
 
-    kmeans = MiniBatchKMeans(
-        n_clusters=n_clusters,
-        random_state=RANDOM_STATE,
-        batch_size=10000,
-        n_init=10,
-        max_iter=300,
-        verbose=1
-    )
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            random_state=RANDOM_STATE,
+            batch_size=10000,
+            n_init=10,
+            max_iter=300,
+            verbose=1
+        )
 
-    labels = kmeans.fit_predict(X)
+        labels = kmeans.fit_predict(X)
 
     # Report cluster sizes
     unique, counts = np.unique(labels, return_counts=True)
@@ -198,32 +250,30 @@ def save_cluster_ids(conn, basin_ids, cluster_labels):
             END $$;
         """)
 
-        # Create index if it doesn't exist
+        # Stream (id, cluster_id) pairs into a temp table with one binary COPY,
+        # then apply them with a single joined UPDATE instead of one UPDATE per basin
         cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_basin08_cluster_id
-            ON basin08(cluster_id);
+            CREATE TEMP TABLE tmp_clusters (id bigint PRIMARY KEY, cluster_id integer)
+            ON COMMIT DROP
         """)
+        with cur.copy("COPY tmp_clusters (id, cluster_id) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(['int8', 'int4'])
+            for bid, label in zip(basin_ids.tolist(), cluster_labels.tolist()):
+                copy.write_row((bid, label))
 
-        # Update in batches
-        batch_size = 10000
-        total = len(basin_ids)
-
-        for i in range(0, total, batch_size):
-            batch_ids = basin_ids[i:i+batch_size]
-            batch_labels = cluster_labels[i:i+batch_size]
-
-            # Build VALUES clause
-            values = [(int(bid), int(label)) for bid, label in zip(batch_ids, batch_labels)]
-
-            # Use executemany with UPDATE
-            cur.executemany(
-                "UPDATE basin08 SET cluster_id = %s WHERE id = %s",
-                [(label, bid) for bid, label in values]
-            )
+        cur.execute("""
+            UPDATE basin08 SET cluster_id = t.cluster_id
+            FROM tmp_clusters t
+            WHERE basin08.id = t.id
+        """)
+        print(f"  Updated {cur.rowcount:,} / {len(basin_ids):,} basins")
 
-            if (i + batch_size) % 50000 == 0 or i + batch_size >= total:
-                pct = min(100, 100 * (i + batch_size) / total)
-                print(f"  Updated {min(i + batch_size, total):,} / {total:,} ({pct:.0f}%)")
+        # Create index if it doesn't exist; after the bulk update, so it is
+        # built once rather than maintained row by row
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_basin08_cluster_id
+            ON basin08(cluster_id);
+        """)
 
         conn.commit()
 
@@ -266,14 +316,13 @@ def main():
 
     try:
         # Load features
-        df = load_basin_features(conn)
-        basin_ids = df['id'].values
+        basin_ids, values = load_basin_features(conn)
 
         # Prepare feature matrix
-        X = prepare_features(df)
+        X = prepare_features(values)
 
         # Free memory
-        del df
+        del values
 
         # Cluster
         labels, kmeans = cluster_basins(X, N_CLUSTERS)
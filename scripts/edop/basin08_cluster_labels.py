@@ -68,25 +68,34 @@ def get_db_connection():
     )
 
 
-def get_dominant_categorical(matrix, assignments, cluster_id, feature_names, cat_prefix, top_n=3):
-    """Get the most common categorical value for a cluster."""
-    mask = assignments == cluster_id
-    cluster_matrix = matrix[mask]
+def cluster_indicator(assignments, n_clusters):
+    """Sparse (basins x clusters) 0/1 matrix; indicator.T @ X sums X's rows per cluster."""
+    n = len(assignments)
+    return sparse.csr_matrix(
+        (np.ones(n), (np.arange(n), assignments)), shape=(n, n_clusters)
+    )
+
 
+def categorical_sums(matrix, indicator, feature_names, cat_prefix):
+    """Per-cluster sums of the one-hot columns matching the prefix, for every cluster at once."""
     # Find columns matching the prefix
     cat_cols = [(i, name) for i, name in enumerate(feature_names)
                 if name.startswith(f"cat_{cat_prefix}_")]
 
     if not cat_cols:
-        return []
+        return [], None
 
-    # Sum across cluster to find most common categories
     col_indices = [c[0] for c in cat_cols]
     col_names = [c[1] for c in cat_cols]
 
-    # Get dense representation for these columns
-    cat_data = cluster_matrix[:, col_indices].toarray()
-    col_sums = cat_data.sum(axis=0)
+    # (clusters x categories), from one pass over the selected columns
+    return col_names, (indicator.T @ matrix[:, col_indices]).toarray()
+
+
+def get_dominant_categorical(col_names, col_sums, count, top_n=3):
+    """Get the most common categorical values for a cluster from its category sums."""
+    if not col_names:
+        return []
 
     # Get top N
     top_indices = np.argsort(col_sums)[-top_n:][::-1]
@@ -95,7 +104,7 @@ def get_dominant_categorical(matrix, assignments, cluster_id, feature_names, cat
         if col_sums[idx] > 0:
             # Extract the ID from column name (e.g., "cat_tbi_7" -> 7)
             cat_id = col_names[idx].split("_")[-1]
-            pct = 100 * col_sums[idx] / mask.sum()
+            pct = 100 * col_sums[idx] / count
             results.append((cat_id, pct))
 
     return results
@@ -115,8 +124,8 @@ def main():
     print(f"   Matrix: {matrix.shape}")
     print(f"   Assignments: {len(assignments)}")
 
-    # Get cluster counts
-    unique, counts = np.unique(assignments, return_counts=True)
+    # Get cluster counts; inverse maps each basin to its row in unique
+    unique, inverse, counts = np.unique(assignments, return_inverse=True, return_counts=True)
     cluster_counts = dict(zip(unique, counts))
 
     # Load lookup tables for categorical interpretation
@@ -156,15 +165,18 @@ def main():
 
     cluster_info = []
 
-    # Convert to dense for numerical features (first 31 columns only)
-    numerical_data = matrix[:, :31].toarray()
+    # Every cluster's numerical means (first 31 columns) and categorical sums
+    # from one sparse product each, rather than masking the matrix per cluster
+    indicator = cluster_indicator(inverse, len(unique))
+    numerical_means = (indicator.T @ matrix[:, :31]).toarray() / counts[:, None]
+    biome_names, biome_sums = categorical_sums(matrix, indicator, feature_names, "tbi")
+    clz_names, clz_sums = categorical_sums(matrix, indicator, feature_names, "clz")
 
-    for cluster_id in sorted(unique):
-        mask = assignments == cluster_id
+    for row, cluster_id in enumerate(unique):
         count = cluster_counts[cluster_id]
 
         # Numerical feature means for this cluster
-        cluster_numerical = numerical_data[mask].mean(axis=0)
+        cluster_numerical = numerical_means[row]
 
         # Key characteristics
         temp = cluster_numerical[KEY_FEATURES["temp_yr"]]
@@ -176,10 +188,12 @@ def main():
         permafrost = cluster_numerical[KEY_FEATURES["permafrost_extent"]]
 
         # Dominant biome
-        top_biomes = get_dominant_categorical(matrix, assignments, cluster_id, feature_names, "tbi", 2)
+        top_biomes = get_dominant_categorical(
+            biome_names, biome_sums[row] if biome_names else None, count, 2)
 
         # Dominant climate zone
-        top_clz = get_dominant_categorical(matrix, assignments, cluster_id, feature_names, "clz", 2)
+        top_clz = get_dominant_categorical(
+            clz_names, clz_sums[row] if clz_names else None, count, 2)
 
         # Generate label based on characteristics
         label_parts = []
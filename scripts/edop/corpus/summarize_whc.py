@@ -10,7 +10,9 @@ Usage:
 
 import json
 import os
-import time
+import re
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import load_dotenv
@@ -25,18 +27,29 @@ if not api_key:
 
 import anthropic
 
+from scripts.shared.json_io import json_bytes, json_loads
+from scripts.shared.rate_limit import RateLimiter
+
 # Paths
 INPUT_DIR = Path("output/corpus_258")
 SECTIONS_FILE = INPUT_DIR / "wiki_sections.json"
 OUTPUT_FILE = INPUT_DIR / "band_summaries.json"
+# Append-only checkpoint: one JSON line per finished city
+CHECKPOINT_FILE = INPUT_DIR / "band_summaries.ndjson"
 MAPPING_FILE = Path("output/corpus/band_mapping_draft.json")
 
 # Load mapping
 with open(MAPPING_FILE) as f:
     MAPPING = json.load(f)
 
-# Claude client
-client = anthropic.Anthropic(api_key=api_key)
+# Claude client; 429s and overloads are retried by the SDK with backoff
+client = anthropic.Anthropic(api_key=api_key, max_retries=5)
+
+# Cities summarized concurrently (each runs its bands in turn), paced by a
+# shared requests/tokens-per-minute budget (RateLimiter.from_env) instead of
+# a fixed sleep per call.
+MAX_WORKERS = 10
+MAX_TOKENS = 500
 
 BANDS = ['history', 'environment', 'culture', 'modern']
 
@@ -69,27 +82,34 @@ If the source text lacks information on a topic, simply omit that topic rather t
 Write in clear, neutral academic prose without promotional language."""
 
 
-def get_band(heading: str) -> str | None:
-    """Apply mapping rules to get band for a section heading."""
-    h = heading.lower().strip()
+limiter = RateLimiter.from_env()
+
+
+def _rule_regex(rules: dict) -> re.Pattern | None:
+    """One alternation over a rule set's 'contains' and 'endswith' patterns."""
+    alternatives = [re.escape(p) for p in rules.get('contains', [])]
+    alternatives += [re.escape(p) + r'\Z' for p in rules.get('endswith', [])]
+    return re.compile('|'.join(alternatives)) if alternatives else None
+
 
-    exc = MAPPING['exclude']
-    if h in exc['exact']:
+# Mapping rules compiled once: exact headings as sets, substring/suffix rules as one regex
+EXCLUDE_EXACT = frozenset(MAPPING['exclude']['exact'])
+EXCLUDE_RE = _rule_regex({'contains': MAPPING['exclude'].get('contains', [])})
+BAND_EXACT = {band: frozenset(MAPPING[band]['exact']) for band in BANDS}
+BAND_RE = {band: _rule_regex(MAPPING[band]) for band in BANDS}
+
+
+# Headings repeat heavily across cities ("History", "Climate", ...), and the
+# compiled rules above never change, so each distinct heading is classified once
+@lru_cache(maxsize=None)
+def get_band(title_lc: str) -> str | None:
+    """Apply mapping rules to get band for a section heading, given lowercased and stripped."""
+    if title_lc in EXCLUDE_EXACT or (EXCLUDE_RE and EXCLUDE_RE.search(title_lc)):
         return None
-    for pattern in exc.get('contains', []):
-        if pattern in h:
-            return None
 
     for band in BANDS:
-        rules = MAPPING[band]
-        if h in rules['exact']:
+        if title_lc in BAND_EXACT[band] or (BAND_RE[band] and BAND_RE[band].search(title_lc)):
             return band
-        for pattern in rules.get('contains', []):
-            if pattern in h:
-                return band
-        for pattern in rules.get('endswith', []):
-            if h.endswith(pattern):
-                return band
 
     return None
 
@@ -99,7 +119,7 @@ def aggregate_band_text(city_data: dict) -> dict[str, str]:
     band_texts = {band: [] for band in BANDS}
 
     for sec in city_data.get('sections', []):
-        band = get_band(sec['title'])
+        band = get_band(sec['_title_lc'])
         if band and band in band_texts:
             band_texts[band].append(f"[{sec['title']}]\n{sec['text']}")
 
@@ -123,18 +143,24 @@ def summarize_band(place_name: str, band: str, source_text: str) -> dict:
     if len(source_text) > max_source:
         source_text = source_text[:max_source] + "\n\n[Source text truncated...]"
 
+    content = f"{prompt}\n\n--- SOURCE TEXT ---\n\n{source_text}"
+
     try:
-        response = client.messages.create(
+        # ~4 chars per input token, plus the full output allowance
+        limiter.acquire((len(SYSTEM_PROMPT) + len(content)) // 4 + MAX_TOKENS)
+        raw = client.messages.with_raw_response.create(
             model="claude-sonnet-4-20250514",
-            max_tokens=500,
+            max_tokens=MAX_TOKENS,
             system=SYSTEM_PROMPT,
             messages=[
                 {
                     "role": "user",
-                    "content": f"{prompt}\n\n--- SOURCE TEXT ---\n\n{source_text}"
+                    "content": content
                 }
             ]
         )
+        limiter.sync(raw.headers)
+        response = raw.parse()
 
         summary = response.content[0].text
 
@@ -178,8 +204,6 @@ def process_city(city_data: dict) -> dict:
         else:
             result = summarize_band(place_name, band, source_text)
             summaries[band] = result
-            # Rate limiting
-            time.sleep(0.3)
 
     return {
         "whc_id": city_data['whc_id'],
@@ -193,6 +217,37 @@ def process_city(city_data: dict) -> dict:
     }
 
 
+def load_checkpoint() -> dict[str, dict]:
+    """Restore finished cities from CHECKPOINT_FILE (or a previous OUTPUT_FILE), keyed by whc_id."""
+    if not CHECKPOINT_FILE.exists() and OUTPUT_FILE.exists():
+        # Output of an earlier run without a log: carry it over
+        with open(OUTPUT_FILE, 'rb') as f:
+            existing = json_loads(f.read())
+        with open(CHECKPOINT_FILE, 'wb') as f:
+            for r in existing:
+                f.write(json_bytes(r) + b'\n')
+
+    done = {}
+    if CHECKPOINT_FILE.exists():
+        with open(CHECKPOINT_FILE, 'rb+') as f:
+            pos = 0
+            for line in iter(f.readline, b''):
+                try:
+                    r = json_loads(line)
+                except ValueError:
+                    f.truncate(pos)  # partial last line from an interrupted write
+                    break
+                pos = f.tell()
+                # A city retried after an error is logged again; the last line wins
+                done[r['whc_id']] = r
+    return done
+
+
+def is_complete(result: dict) -> bool:
+    """True if no band of a logged city failed, so it need not be summarized again."""
+    return all(b.get('status') != 'error' for b in result['summaries'].values())
+
+
 def main():
     print(f"Loading sections from {SECTIONS_FILE}...")
     with open(SECTIONS_FILE) as f:
@@ -202,49 +257,64 @@ def main():
     cities_ok = [c for c in cities if c.get('status') == 'ok']
     print(f"Processing {len(cities_ok)} cities (of {len(cities)} total)...\n")
 
-    results = []
-    total_tokens = {"input": 0, "output": 0}
-    errors = []
-
-    for i, city in enumerate(cities_ok, 1):
-        bands_with_content = sum(
-            1 for sec in city.get('sections', [])
-            if get_band(sec['title']) in BANDS
-        )
-
-        print(f"[{i:3d}/{len(cities_ok)}] {city['city'][:30]:<30} ({city['ccode']})...", end=" ", flush=True)
+    # Normalize every heading once here rather than on each classification
+    for city in cities_ok:
+        for sec in city.get('sections', []):
+            sec['_title_lc'] = sec['title'].lower().strip()
 
-        try:
-            result = process_city(city)
-            results.append(result)
+    # Resume: cities already summarized without errors are not sent again
+    done = load_checkpoint()
+    done_ids = {whc_id for whc_id, r in done.items() if is_complete(r)}
+    pending = [c for c in cities_ok if c['whc_id'] not in done_ids]
+    if done_ids:
+        print(f"Resuming from checkpoint: {len(done_ids)} cities already summarized\n")
 
-            # Tally tokens and count successful bands
-            ok_bands = 0
-            for band_result in result['summaries'].values():
-                if band_result.get('status') == 'ok':
-                    total_tokens['input'] += band_result.get('input_tokens', 0)
-                    total_tokens['output'] += band_result.get('output_tokens', 0)
-                    ok_bands += 1
-
-            print(f"{ok_bands}/4 bands summarized")
-
-        except Exception as e:
-            print(f"[ERROR: {e}]")
-            errors.append((city['city'], str(e)))
+    results = [r for r in done.values() if r['whc_id'] in done_ids]
+    total_tokens = {"input": 0, "output": 0}
+    errors = []
 
-        # Checkpoint every 50 cities
-        if i % 50 == 0:
-            checkpoint_path = INPUT_DIR / f"band_summaries_checkpoint_{i}.json"
-            with open(checkpoint_path, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
-            print(f"  [Checkpoint saved: {checkpoint_path}]")
+    # Cities finish out of order; results, tallies and checkpoints stay on this thread
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool, open(CHECKPOINT_FILE, 'ab') as log:
+        futures = {pool.submit(process_city, city): city for city in pending}
+        for i, future in enumerate(as_completed(futures), len(done_ids) + 1):
+            city = futures[future]
+            print(f"[{i:3d}/{len(cities_ok)}] {city['city'][:30]:<30} ({city['ccode']})...", end=" ")
+
+            try:
+                result = future.result()
+                results.append(result)
+                log.write(json_bytes(result) + b'\n')
+                log.flush()
+
+                # Tally tokens and count successful bands; bands with content come
+                # from process_city's classification rather than a second pass
+                ok_bands = 0
+                bands_with_content = 0
+                for band_result in result['summaries'].values():
+                    if band_result.get('source_chars', 0) > 0:
+                        bands_with_content += 1
+                    if band_result.get('status') == 'ok':
+                        total_tokens['input'] += band_result.get('input_tokens', 0)
+                        total_tokens['output'] += band_result.get('output_tokens', 0)
+                        ok_bands += 1
+
+                print(f"{ok_bands}/4 bands summarized ({bands_with_content} with content)")
+
+            except Exception as e:
+                print(f"[ERROR: {e}]")
+                errors.append((city['city'], str(e)))
+
+    # Keep the output in input order
+    order = {c['whc_id']: n for n, c in enumerate(cities_ok)}
+    results = [r for r in results if r['whc_id'] in order]
+    results.sort(key=lambda r: order[r['whc_id']])
 
     # Write final results
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, 'wb') as f:
+        f.write(json_bytes(results, indent=True))
 
     print(f"\nWrote summaries to {OUTPUT_FILE}")
-    print(f"\nToken usage: {total_tokens['input']:,} input, {total_tokens['output']:,} output")
+    print(f"\nToken usage (this run): {total_tokens['input']:,} input, {total_tokens['output']:,} output")
 
     # Estimate cost (Claude Sonnet pricing ~$3/M input, $15/M output)
     cost_est = (total_tokens['input'] * 3 + total_tokens['output'] * 15) / 1_000_000
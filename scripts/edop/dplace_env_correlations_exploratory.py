@@ -80,112 +80,98 @@ def get_connection():
     return psycopg.connect(**DB_PARAMS)
 
 
-def load_society_env_data(conn):
-    """Load societies with environmental features directly from basin08."""
-    env_cols = ', '.join([f'b.{col}' for col in ENV_FEATURES.keys()])
-    query = f"""
-        SELECT
-            s.id as soc_id,
-            s.name as society,
-            s.region,
-            {env_cols}
-        FROM gaz.dplace_societies s
-        JOIN public.basin08 b ON b.hybas_id = s.basin_id
-        WHERE s.basin_id IS NOT NULL
+def load_category_stats(conn, var_ids, env_features):
     """
-    return pd.read_sql(query, conn)
-
+    Load per-category aggregates of every env feature for each cultural variable.
 
-def load_cultural_data(conn, var_ids):
-    """Load cultural variable values for societies."""
-    var_list = "', '".join(var_ids)
+    The join and GROUP BY run in PostgreSQL, so only one row per
+    (var_id, category) comes back: the category's society count plus, for
+    each env column, the non-null count, mean and population variance.
+    """
+    aggs = ',\n            '.join(
+        f'COUNT(b.{col}) AS n_{col}, '
+        f'AVG(b.{col})::float8 AS mean_{col}, '
+        f'VAR_POP(b.{col})::float8 AS var_{col}'
+        for col in env_features
+    )
     query = f"""
         SELECT
-            d.soc_id,
-            v.id as var_id,
+            d.var_id,
             v.name as var_name,
-            c.name as value
+            c.name as value,
+            COUNT(*) AS n,
+            {aggs}
         FROM gaz.dplace_data d
         JOIN gaz.dplace_variables v ON v.id = d.var_id
         JOIN gaz.dplace_codes c ON c.id = d.code_id
-        WHERE d.var_id IN ('{var_list}')
+        JOIN gaz.dplace_societies s ON s.id = d.soc_id
+        JOIN public.basin08 b ON b.hybas_id = s.basin_id
+        WHERE d.var_id = ANY(%s)
           AND c.name NOT IN ('Missing data', '')
+        GROUP BY d.var_id, v.name, c.name
     """
-    return pd.read_sql(query, conn)
+    with conn.cursor() as cur:
+        cur.execute(query, (list(var_ids),))
+        columns = [desc.name for desc in cur.description]
+        return pd.DataFrame(cur.fetchall(), columns=columns)
 
 
-def compute_correlations(env_df, culture_df, env_features, min_societies=10):
+def compute_correlations(stats_df, env_features, min_societies=10):
     """
-    For each cultural variable, compute ANOVA F-statistic for each env feature.
+    For each cultural variable, compute ANOVA F-statistic for each env feature
+    from the per-category aggregates returned by load_category_stats.
     Returns DataFrame of (cultural_var, env_feature, F_stat, p_value, effect_size).
     """
     results = []
+    env_cols = list(env_features)
 
-    # Merge env and culture data
-    merged = culture_df.merge(env_df, on='soc_id')
-
-    # Get unique cultural variables
-    cultural_vars = merged['var_id'].unique()
-    env_cols = [c for c in env_df.columns if c in env_features]
-
-    for var_id in cultural_vars:
-        var_data = merged[merged['var_id'] == var_id]
-        var_name = var_data['var_name'].iloc[0]
+    for var_id, var_stats in stats_df.groupby('var_id', sort=False):
+        var_name = var_stats['var_name'].iloc[0]
 
         # Get categories with enough societies
-        category_counts = var_data['value'].value_counts()
-        valid_categories = category_counts[category_counts >= min_societies].index.tolist()
+        var_stats = var_stats[var_stats['n'] >= min_societies].set_index('value')
+        valid_categories = var_stats.index.tolist()
 
         if len(valid_categories) < 2:
             continue
 
-        var_data_filtered = var_data[var_data['value'].isin(valid_categories)]
+        n_societies = int(var_stats['n'].sum())
+        n = var_stats[[f'n_{col}' for col in env_cols]].set_axis(env_cols, axis=1).astype(float)
+        mu = var_stats[[f'mean_{col}' for col in env_cols]].set_axis(env_cols, axis=1).astype(float)
+        var = var_stats[[f'var_{col}' for col in env_cols]].set_axis(env_cols, axis=1).astype(float)
+
+        # ANOVA only over categories with at least 3 values in that column;
+        # F and eta-squared follow from the between/within sums of squares
+        in_anova = n >= 3
+        n_a = n.where(in_anova, 0)
+        k = in_anova.sum()
+        n_total = n_a.sum()
+        grand_mean = (n_a * mu.where(in_anova, 0)).sum() / n_total
+        ss_between = (n_a * (mu - grand_mean) ** 2).where(in_anova, 0).sum()
+        ss_within = (n_a * var).where(in_anova, 0).sum()
+        ss_total = ss_between + ss_within
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_stat = (ss_between / (k - 1)) / (ss_within / (n_total - k))
+        p_value = pd.Series(stats.f.sf(f_stat, k - 1, n_total - k), index=env_cols)
 
         for env_col in env_cols:
-            # Skip if too many NaN values
-            env_values = var_data_filtered[env_col].dropna()
-            if len(env_values) < min_societies * 2:
+            # Skip if too many NaN values, or too few categories to compare
+            if n[env_col].sum() < min_societies * 2 or k[env_col] < 2:
                 continue
 
-            # Group by cultural category
-            groups = [
-                var_data_filtered[var_data_filtered['value'] == cat][env_col].dropna().values
-                for cat in valid_categories
-            ]
-            groups = [g for g in groups if len(g) >= 3]
-
-            if len(groups) < 2:
-                continue
-
-            try:
-                # ANOVA
-                f_stat, p_value = stats.f_oneway(*groups)
-
-                # Effect size (eta-squared)
-                all_values = np.concatenate(groups)
-                grand_mean = np.mean(all_values)
-                ss_between = sum(len(g) * (np.mean(g) - grand_mean)**2 for g in groups)
-                ss_total = sum((v - grand_mean)**2 for v in all_values)
-                eta_sq = ss_between / ss_total if ss_total > 0 else 0
-
+            results.append({
+                'cultural_var_id': var_id,
+                'cultural_var': var_name,
+                'env_feature': env_col,
+                'env_description': env_features.get(env_col, env_col),
+                'n_categories': len(valid_categories),
+                'n_societies': n_societies,
+                'f_stat': f_stat[env_col],
+                'p_value': p_value[env_col],
+                'eta_squared': ss_between[env_col] / ss_total[env_col] if ss_total[env_col] > 0 else 0,
                 # Category means for interpretation
-                cat_means = {cat: var_data_filtered[var_data_filtered['value'] == cat][env_col].mean()
-                            for cat in valid_categories}
-
-                results.append({
-                    'cultural_var_id': var_id,
-                    'cultural_var': var_name,
-                    'env_feature': env_col,
-                    'env_description': env_features.get(env_col, env_col),
-                    'n_categories': len(valid_categories),
-                    'n_societies': len(var_data_filtered),
-                    'f_stat': f_stat,
-                    'p_value': p_value,
-                    'eta_squared': eta_sq,
-                    'category_means': cat_means,
-                })
-            except Exception as e:
-                continue
+                'category_means': mu[env_col].to_dict(),
+            })
 
     return pd.DataFrame(results)
 
@@ -201,14 +187,14 @@ def summarize_top_correlations(results_df, top_n=20):
     print(f"NOTE: Using EXPLORATORY basin08 variables, not EDOP signature fields")
     print(f"{'='*80}\n")
 
-    for i, row in sig_results.head(top_n).iterrows():
-        print(f"{row['cultural_var']}")
-        print(f"  vs {row['env_description']}")
-        print(f"  Effect size (η²): {row['eta_squared']:.3f}  |  F: {row['f_stat']:.1f}  |  p: {row['p_value']:.2e}")
-        print(f"  Categories: {row['n_categories']}  |  Societies: {row['n_societies']}")
+    for row in sig_results.head(top_n).itertuples(index=False):
+        print(f"{row.cultural_var}")
+        print(f"  vs {row.env_description}")
+        print(f"  Effect size (η²): {row.eta_squared:.3f}  |  F: {row.f_stat:.1f}  |  p: {row.p_value:.2e}")
+        print(f"  Categories: {row.n_categories}  |  Societies: {row.n_societies}")
 
         # Show category means
-        means = row['category_means']
+        means = row.category_means
         sorted_means = sorted(means.items(), key=lambda x: x[1])
         print(f"  Range: {sorted_means[0][0]} ({sorted_means[0][1]:.1f}) → {sorted_means[-1][0]} ({sorted_means[-1][1]:.1f})")
         print()
@@ -232,18 +218,14 @@ def main():
     print("\nConnecting to database...")
     conn = get_connection()
 
-    print("Loading environmental data for societies...")
-    env_df = load_society_env_data(conn)
-    print(f"  Loaded {len(env_df)} societies with basin data")
-
-    print("Loading cultural variable data...")
-    culture_df = load_cultural_data(conn, CULTURAL_VARS)
-    print(f"  Loaded {len(culture_df)} cultural observations")
+    print("Aggregating environmental data by cultural category...")
+    stats_df = load_category_stats(conn, CULTURAL_VARS, ENV_FEATURES)
+    print(f"  Loaded {len(stats_df)} category aggregates")
 
     conn.close()
 
     print(f"\nComputing correlations (min {args.min_societies} societies per category)...")
-    results = compute_correlations(env_df, culture_df, ENV_FEATURES, min_societies=args.min_societies)
+    results = compute_correlations(stats_df, ENV_FEATURES, min_societies=args.min_societies)
     print(f"  Computed {len(results)} variable pairs")
 
     # Summarize top results
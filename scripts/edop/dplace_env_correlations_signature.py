@@ -16,15 +16,32 @@ Usage:
 
 Requires:
     pip install psycopg[binary] pandas scipy python-dotenv
+    (optional) pip install numba     # compiled per-category moments
+    (optional) pip install pyarrow   # Parquet cache of the loaded data (--no-cache to refresh)
 """
 
 import argparse
+import hashlib
 import os
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
 from scipy import stats
 
+# Optional: numba for a compiled per-category moments kernel; NumPy otherwise
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Optional: pyarrow, to cache the loaded frames as Parquet between runs
+try:
+    import pyarrow  # noqa: F401 (pandas' Parquet engine)
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
 load_dotenv()
 
 DB_PARAMS = {
@@ -111,6 +128,10 @@ CULTURAL_VARS = [
 ]
 
 
+# Parquet copies of env_df / culture_df, keyed by the fields and variables loaded
+CACHE_DIR = "output/cache"
+
+
 def get_connection():
     import psycopg
     return psycopg.connect(**DB_PARAMS)
@@ -133,7 +154,7 @@ def load_society_env_data(conn, bands=None):
     if not fields:
         raise ValueError("No fields selected")
 
-    field_list = ', '.join([f'v.{f}' for f in fields.keys()])
+    field_list = ', '.join([f'v.{f}::float8' for f in fields.keys()])
     # dplace_societies.basin_id stores hybas_id (meaningful HydroATLAS ID)
     # v_basin08_persist.id references basin08.id (serial row number)
     # So we join through basin08 to translate: hybas_id → id
@@ -148,13 +169,22 @@ def load_society_env_data(conn, bands=None):
         JOIN public.v_basin08_persist v ON v.id = b.id
         WHERE s.basin_id IS NOT NULL
     """
-    return pd.read_sql(query, conn), fields
+    # Fetch as plain tuples and build the numeric block in one float64 array
+    # (NULL -> NaN) rather than letting pd.read_sql infer dtypes row by row
+    with conn.cursor() as cur:
+        cur.execute(query)
+        rows = cur.fetchall()
+    ids = list(zip(*rows)) if rows else [(), (), ()]
+    values = np.array([r[3:] for r in rows], dtype=np.float64).reshape(len(rows), len(fields))
+
+    env_df = pd.DataFrame({'soc_id': ids[0], 'society': ids[1], 'region': ids[2]})
+    env_df = pd.concat([env_df, pd.DataFrame(values, columns=list(fields))], axis=1)
+    return env_df, fields
 
 
 def load_cultural_data(conn, var_ids):
     """Load cultural variable values for societies."""
-    var_list = "', '".join(var_ids)
-    query = f"""
+    query = """
         SELECT
             d.soc_id,
             v.id as var_id,
@@ -163,10 +193,63 @@ def load_cultural_data(conn, var_ids):
         FROM gaz.dplace_data d
         JOIN gaz.dplace_variables v ON v.id = d.var_id
         JOIN gaz.dplace_codes c ON c.id = d.code_id
-        WHERE d.var_id IN ('{var_list}')
+        WHERE d.var_id = ANY(%s)
           AND c.name NOT IN ('Missing data', '')
     """
-    return pd.read_sql(query, conn)
+    with conn.cursor() as cur:
+        cur.execute(query, (list(var_ids),))
+        return pd.DataFrame(cur.fetchall(), columns=['soc_id', 'var_id', 'var_name', 'value'])
+
+
+def cache_paths(field_info, var_ids):
+    """Parquet paths for the env and culture frames of one field/variable selection."""
+    key = hashlib.sha1((",".join(field_info) + "|" + ",".join(var_ids)).encode()).hexdigest()[:12]
+    return (os.path.join(CACHE_DIR, f"env_{key}.parquet"),
+            os.path.join(CACHE_DIR, f"culture_{key}.parquet"))
+
+
+def _group_moments_numpy(x, group, k):
+    """Per-category non-NaN counts, means and sums of squared deviations of each column of x.
+
+    x rows are sorted by their category code in group (0..k-1, every code present).
+    """
+    starts = np.searchsorted(group, np.arange(k))
+    present = ~np.isnan(x)
+    n = np.add.reduceat(present, starts, axis=0).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu = np.add.reduceat(np.where(present, x, 0.0), starts, axis=0) / n
+        dev = np.where(present, x - mu[group], 0.0)
+    return n, mu, np.add.reduceat(dev ** 2, starts, axis=0)
+
+
+if HAS_NUMBA:
+    # No fastmath: it would let the compiler assume away the NaN checks
+    @njit(parallel=True, cache=True)
+    def _group_moments_jit(x, group, k):
+        m, f = x.shape
+        n = np.zeros((k, f))
+        mu = np.zeros((k, f))
+        ss = np.zeros((k, f))
+        for j in prange(f):
+            for i in range(m):
+                v = x[i, j]
+                if not np.isnan(v):
+                    n[group[i], j] += 1.0
+                    mu[group[i], j] += v
+            for g in range(k):
+                mu[g, j] = mu[g, j] / n[g, j] if n[g, j] > 0 else np.nan
+            for i in range(m):
+                v = x[i, j]
+                if not np.isnan(v):
+                    d = v - mu[group[i], j]
+                    ss[group[i], j] += d * d
+        return n, mu, ss
+
+    def group_moments(x, group, k):
+        # Column-major so each parallel column scan is contiguous
+        return _group_moments_jit(np.asfortranarray(x), group.astype(np.intp), k)
+else:
+    group_moments = _group_moments_numpy
 
 
 def compute_correlations(env_df, culture_df, field_info, min_societies=10):
@@ -176,15 +259,18 @@ def compute_correlations(env_df, culture_df, field_info, min_societies=10):
     """
     results = []
 
-    # Merge env and culture data
-    merged = culture_df.merge(env_df, on='soc_id')
-
-    # Get unique cultural variables
-    cultural_vars = merged['var_id'].unique()
+    # Env features as one contiguous (societies x fields) array, and the
+    # society -> row lookup used in place of merging the frames
     env_cols = [c for c in env_df.columns if c in field_info]
+    env = np.ascontiguousarray(env_df[env_cols].to_numpy(dtype=np.float64))
+    soc_row = {sid: i for i, sid in enumerate(env_df['soc_id'])}
 
-    for var_id in cultural_vars:
-        var_data = merged[merged['var_id'] == var_id]
+    for var_id, var_data in culture_df.groupby('var_id', sort=False):
+        rows = var_data['soc_id'].map(soc_row)
+        var_data = var_data[rows.notna()]
+        if var_data.empty:
+            continue
+        rows = rows[rows.notna()].to_numpy(dtype=np.intp)
         var_name = var_data['var_name'].iloc[0]
 
         # Get categories with enough societies
@@ -194,55 +280,51 @@ def compute_correlations(env_df, culture_df, field_info, min_societies=10):
         if len(valid_categories) < 2:
             continue
 
-        var_data_filtered = var_data[var_data['value'].isin(valid_categories)]
-
-        for env_col in env_cols:
-            # Skip if too many NaN values
-            env_values = var_data_filtered[env_col].dropna()
-            if len(env_values) < min_societies * 2:
-                continue
-
-            # Group by cultural category
-            groups = [
-                var_data_filtered[var_data_filtered['value'] == cat][env_col].dropna().values
-                for cat in valid_categories
-            ]
-            groups = [g for g in groups if len(g) >= 3]
-
-            if len(groups) < 2:
+        # Sort the rows by category so each category is one contiguous slice;
+        # count, mean and within-group sum of squares for every field then
+        # come from one group_moments call
+        codes = pd.Categorical(var_data['value'], categories=valid_categories).codes
+        keep = codes >= 0
+        order = np.argsort(codes[keep], kind='stable')
+        group = codes[keep][order]
+        x = env[rows[keep][order]]
+        n_societies = len(group)
+
+        n, mu, ss_group = group_moments(x, group, len(valid_categories))
+
+        # ANOVA only over categories with at least 3 values in that field
+        in_anova = n >= 3
+        n_a = np.where(in_anova, n, 0.0)
+        k = in_anova.sum(axis=0)
+        n_total = n_a.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            grand_mean = (n_a * np.where(in_anova, mu, 0.0)).sum(axis=0) / n_total
+            ss_between = np.where(in_anova, n_a * (mu - grand_mean) ** 2, 0.0).sum(axis=0)
+            ss_within = np.where(in_anova, ss_group, 0.0).sum(axis=0)
+            f_stat = (ss_between / (k - 1)) / (ss_within / (n_total - k))
+        p_value = stats.f.sf(f_stat, k - 1, n_total - k)
+        ss_total = ss_between + ss_within
+
+        for j, env_col in enumerate(env_cols):
+            # Skip if too many NaN values, or too few categories to compare
+            if n[:, j].sum() < min_societies * 2 or k[j] < 2:
                 continue
 
-            try:
-                # ANOVA
-                f_stat, p_value = stats.f_oneway(*groups)
-
-                # Effect size (eta-squared)
-                all_values = np.concatenate(groups)
-                grand_mean = np.mean(all_values)
-                ss_between = sum(len(g) * (np.mean(g) - grand_mean)**2 for g in groups)
-                ss_total = sum((v - grand_mean)**2 for v in all_values)
-                eta_sq = ss_between / ss_total if ss_total > 0 else 0
-
+            results.append({
+                'band': field_info[env_col]['band'],
+                'band_label': SIGNATURE_BANDS[field_info[env_col]['band']]['label'],
+                'cultural_var_id': var_id,
+                'cultural_var': var_name,
+                'env_feature': env_col,
+                'env_description': field_info[env_col]['description'],
+                'n_categories': len(valid_categories),
+                'n_societies': n_societies,
+                'f_stat': f_stat[j],
+                'p_value': p_value[j],
+                'eta_squared': ss_between[j] / ss_total[j] if ss_total[j] > 0 else 0,
                 # Category means for interpretation
-                cat_means = {cat: var_data_filtered[var_data_filtered['value'] == cat][env_col].mean()
-                            for cat in valid_categories}
-
-                results.append({
-                    'band': field_info[env_col]['band'],
-                    'band_label': SIGNATURE_BANDS[field_info[env_col]['band']]['label'],
-                    'cultural_var_id': var_id,
-                    'cultural_var': var_name,
-                    'env_feature': env_col,
-                    'env_description': field_info[env_col]['description'],
-                    'n_categories': len(valid_categories),
-                    'n_societies': len(var_data_filtered),
-                    'f_stat': f_stat,
-                    'p_value': p_value,
-                    'eta_squared': eta_sq,
-                    'category_means': cat_means,
-                })
-            except Exception as e:
-                continue
+                'category_means': dict(zip(valid_categories, mu[:, j].tolist())),
+            })
 
     return pd.DataFrame(results)
 
@@ -267,22 +349,22 @@ def summarize_top_correlations(results_df, top_n=20, by_band=False):
             print(f"\n--- BAND {band_code}: {band_info['label']} ---")
             print(f"    ({band_info['description']})\n")
 
-            for i, row in band_results.head(5).iterrows():
-                print(f"  {row['cultural_var']}")
-                print(f"    vs {row['env_description']}")
-                print(f"    η² = {row['eta_squared']:.3f}  |  F = {row['f_stat']:.1f}  |  n = {row['n_societies']}")
-                means = row['category_means']
+            for row in band_results.head(5).itertuples(index=False):
+                print(f"  {row.cultural_var}")
+                print(f"    vs {row.env_description}")
+                print(f"    η² = {row.eta_squared:.3f}  |  F = {row.f_stat:.1f}  |  n = {row.n_societies}")
+                means = row.category_means
                 sorted_means = sorted(means.items(), key=lambda x: x[1])
                 print(f"    {sorted_means[0][0]} ({sorted_means[0][1]:.1f}) → {sorted_means[-1][0]} ({sorted_means[-1][1]:.1f})")
                 print()
     else:
-        for i, row in sig_results.head(top_n).iterrows():
-            print(f"[Band {row['band']}] {row['cultural_var']}")
-            print(f"  vs {row['env_description']}")
-            print(f"  Effect size (η²): {row['eta_squared']:.3f}  |  F: {row['f_stat']:.1f}  |  p: {row['p_value']:.2e}")
-            print(f"  Categories: {row['n_categories']}  |  Societies: {row['n_societies']}")
+        for row in sig_results.head(top_n).itertuples(index=False):
+            print(f"[Band {row.band}] {row.cultural_var}")
+            print(f"  vs {row.env_description}")
+            print(f"  Effect size (η²): {row.eta_squared:.3f}  |  F: {row.f_stat:.1f}  |  p: {row.p_value:.2e}")
+            print(f"  Categories: {row.n_categories}  |  Societies: {row.n_societies}")
 
-            means = row['category_means']
+            means = row.category_means
             sorted_means = sorted(means.items(), key=lambda x: x[1])
             print(f"  Range: {sorted_means[0][0]} ({sorted_means[0][1]:.1f}) → {sorted_means[-1][0]} ({sorted_means[-1][1]:.1f})")
             print()
@@ -300,6 +382,8 @@ def main():
                        help="Group output by band")
     parser.add_argument("--output", type=str, default="output/dplace_correlations_signature.csv",
                        help="Output CSV file")
+    parser.add_argument("--no-cache", action="store_true",
+                       help=f"Reload from the database instead of the Parquet cache in {CACHE_DIR}")
     args = parser.parse_args()
 
     if args.band == 'all':
@@ -318,18 +402,33 @@ def main():
         print(f"Filtered to Band {args.band}: {SIGNATURE_BANDS[args.band]['label']}")
     print("="*60)
 
-    print("\nConnecting to database...")
-    conn = get_connection()
+    field_info = get_all_signature_fields(bands)
+    env_path, culture_path = cache_paths(field_info, CULTURAL_VARS)
+
+    if HAS_PARQUET and not args.no_cache and os.path.exists(env_path) and os.path.exists(culture_path):
+        print(f"\nLoading cached data ({env_path}, {culture_path})...")
+        env_df = pd.read_parquet(env_path)
+        culture_df = pd.read_parquet(culture_path)
+        print(f"  Loaded {len(env_df)} societies with {len(field_info)} signature fields")
+        print(f"  Loaded {len(culture_df)} cultural observations")
+    else:
+        print("\nConnecting to database...")
+        conn = get_connection()
+
+        print("Loading environmental data for societies...")
+        env_df, field_info = load_society_env_data(conn, bands)
+        print(f"  Loaded {len(env_df)} societies with {len(field_info)} signature fields")
 
-    print("Loading environmental data for societies...")
-    env_df, field_info = load_society_env_data(conn, bands)
-    print(f"  Loaded {len(env_df)} societies with {len(field_info)} signature fields")
+        print("Loading cultural variable data...")
+        culture_df = load_cultural_data(conn, CULTURAL_VARS)
+        print(f"  Loaded {len(culture_df)} cultural observations")
 
-    print("Loading cultural variable data...")
-    culture_df = load_cultural_data(conn, CULTURAL_VARS)
-    print(f"  Loaded {len(culture_df)} cultural observations")
+        conn.close()
 
-    conn.close()
+        if HAS_PARQUET:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            env_df.to_parquet(env_path, compression='zstd', index=False)
+            culture_df.to_parquet(culture_path, compression='zstd', index=False)
 
     print(f"\nComputing correlations (min {args.min_societies} societies per category)...")
     results = compute_correlations(env_df, culture_df, field_info, min_societies=args.min_societies)
@@ -0,0 +1,21 @@
+"""
+Stdout settings for the report scripts that print many short lines.
+"""
+import sys
+from contextlib import contextmanager
+
+
+@contextmanager
+def block_buffered_stdout():
+    """Block-buffer sys.stdout, even on a terminal, for the duration of the block.
+
+    The previous buffering is restored (and the buffer flushed) on exit, so
+    the interpreter-wide setting only changes while a report is running.
+    """
+    line_buffering = sys.stdout.line_buffering
+    write_through = sys.stdout.write_through
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    try:
+        yield
+    finally:
+        sys.stdout.reconfigure(line_buffering=line_buffering, write_through=write_through)
@@ -0,0 +1,24 @@
+"""
+JSON encode/decode through orjson when it is installed, stdlib json otherwise.
+
+Shared by the scripts that write large JSON/JSONL outputs (extractions,
+summaries); both backends produce the same UTF-8 text.
+"""
+import json
+
+# Optional: orjson for faster parsing/serializing; stdlib json otherwise
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Accepts str or bytes; orjson.JSONDecodeError subclasses json.JSONDecodeError
+json_loads = orjson.loads if HAS_ORJSON else json.loads
+
+
+def json_bytes(obj, indent: bool = False) -> bytes:
+    """UTF-8 JSON for obj (orjson when available), optionally 2-space indented."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
@@ -0,0 +1,75 @@
+"""
+Client-side request pacing shared by the API and scraping scripts.
+
+One RateLimiter is created per run and passed to (or shared by) the worker
+threads; each call acquire()s before it goes out.
+"""
+import os
+import threading
+import time
+
+# Anthropic API budgets used when ANTHROPIC_RPM / ANTHROPIC_TPM are unset:
+# the Tier 2 limits. Set the variables to match the account.
+DEFAULT_ANTHROPIC_RPM = 1000
+DEFAULT_ANTHROPIC_TPM = 450000
+
+
+class RateLimiter:
+    """Requests-per-minute and, optionally, tokens-per-minute budgets shared across threads.
+
+    Both refill continuously; acquire() blocks until one request and the
+    estimated tokens are available, then spends them, so calls are paced
+    before they can hit a 429 rather than after.
+
+    burst caps how many requests can start back to back after an idle spell
+    (default: a full minute's worth). burst=1 spaces every request start
+    60 / requests_per_minute seconds apart, for servers that should see a
+    steady trickle rather than bursts.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: int | None = None,
+                 burst: float | None = None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.burst = float(requests_per_minute if burst is None else burst)
+        self.requests = self.burst
+        self.tokens = float(tokens_per_minute or 0)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, burst: float | None = None) -> 'RateLimiter':
+        """A limiter for the Anthropic API, budgets read from ANTHROPIC_RPM / ANTHROPIC_TPM."""
+        return cls(int(os.getenv('ANTHROPIC_RPM', DEFAULT_ANTHROPIC_RPM)),
+                   int(os.getenv('ANTHROPIC_TPM', DEFAULT_ANTHROPIC_TPM)), burst)
+
+    def acquire(self, tokens: int = 0):
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed, self.last = now - self.last, now
+                self.requests = min(self.burst, self.requests + elapsed * self.rpm / 60)
+                if self.tpm:
+                    self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = (1 - self.requests) * 60 / self.rpm
+                if self.tpm:
+                    wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+            time.sleep(wait)
+
+    def sync(self, headers):
+        """Clamp the budgets to the anthropic-ratelimit-*-remaining response headers.
+
+        Lets other clients on the same API key slow this one down too.
+        """
+        with self.lock:
+            remaining = headers.get('anthropic-ratelimit-requests-remaining')
+            if remaining is not None:
+                self.requests = min(self.requests, float(remaining))
+            remaining = headers.get('anthropic-ratelimit-tokens-remaining')
+            if remaining is not None and self.tpm:
+                self.tokens = min(self.tokens, float(remaining))
@@ -0,0 +1,193 @@
+-- Derived columns and indexes supporting the ich_explore_* scripts
+-- (scripts/cdop/ich_explore_concepts.py, ich_explore_text.py, ich_explore_geography.py,
+-- ich_explore_toponyms.py)
+
+-- Concept list as an array, so concept filters are exact-match and GIN-indexable
+-- instead of LIKE '%concept%' substring scans
+ALTER TABLE cdop.ich_elements
+    ADD COLUMN IF NOT EXISTS primary_concepts_arr text[]
+    GENERATED ALWAYS AS (string_to_array(primary_concepts, '; ')) STORED;
+
+CREATE INDEX IF NOT EXISTS ich_elements_concepts_gin
+    ON cdop.ich_elements USING GIN (primary_concepts_arr);
+
+-- Summary length and (space-separated) word count, computed once at write
+-- time rather than re-tokenizing text in every length/percentile query
+ALTER TABLE cdop.ich_summaries
+    ADD COLUMN IF NOT EXISTS text_len int
+        GENERATED ALWAYS AS (length(text)) STORED,
+    ADD COLUMN IF NOT EXISTS text_wc int
+        GENERATED ALWAYS AS (array_length(string_to_array(text, ' '), 1)) STORED;
+
+CREATE INDEX IF NOT EXISTS ich_summaries_text_len_idx
+    ON cdop.ich_summaries (text_len);
+
+-- Block-range summary of text_len for length-range filters (e.g. one bucket).
+-- Only pays off while text_len tracks physical row order (append-mostly
+-- loads); check pg_stats.correlation. The btree above still serves the
+-- ORDER BY text_len LIMIT queries.
+CREATE INDEX IF NOT EXISTS ich_summaries_textlen_brin
+    ON cdop.ich_summaries USING BRIN (text_len) WITH (pages_per_range = 32);
+
+-- Canonical country-name key (lowercased, accent-stripped) for joining ICH
+-- country strings to gaz.admin0. unaccent() is only STABLE; the wrapper pins
+-- the dictionary so it can be declared IMMUTABLE and used in indexes.
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+CREATE OR REPLACE FUNCTION cdop.country_norm(name text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, trim(name))) $$;
+
+-- Same key on the admin0 side, kept on gaz.admin0 itself so it follows
+-- any reload of that table
+CREATE INDEX IF NOT EXISTS admin0_country_norm_idx
+    ON gaz.admin0 (cdop.country_norm(name));
+
+-- The materialized views further down read ich_element_countries, so they
+-- are dropped before it; otherwise re-running this file fails on the DROP TABLE
+DROP MATERIALIZED VIEW IF EXISTS cdop.mv_toponym_qc_stats;
+DROP MATERIALIZED VIEW IF EXISTS cdop.country_names;
+
+-- Persisted unnest of ich_elements.countries / primary_concepts, so exploration
+-- queries GROUP BY / join a narrow indexed table instead of re-splitting strings
+DROP TABLE IF EXISTS cdop.ich_element_countries;
+CREATE TABLE cdop.ich_element_countries AS
+SELECT ich_id, trim(unnest(string_to_array(countries, ', '))) AS country
+FROM cdop.ich_elements;
+
+CREATE INDEX ON cdop.ich_element_countries (country);
+CREATE INDEX ON cdop.ich_element_countries (ich_id);
+CREATE INDEX ON cdop.ich_element_countries (cdop.country_norm(country));
+
+DROP TABLE IF EXISTS cdop.ich_element_concepts;
+CREATE TABLE cdop.ich_element_concepts AS
+SELECT ich_id, trim(unnest(string_to_array(primary_concepts, '; '))) AS concept
+FROM cdop.ich_elements
+WHERE primary_concepts IS NOT NULL AND primary_concepts != '';
+
+CREATE INDEX ON cdop.ich_element_concepts (concept);
+CREATE INDEX ON cdop.ich_element_concepts (ich_id);
+
+-- Keep both expansions in sync with ich_elements inserts/updates/deletes
+-- (ich_load_new_elements.py, ich_scrape_concepts.py)
+CREATE OR REPLACE FUNCTION cdop.sync_ich_element_expansions() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM cdop.ich_element_countries WHERE ich_id = OLD.ich_id;
+        DELETE FROM cdop.ich_element_concepts WHERE ich_id = OLD.ich_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO cdop.ich_element_countries (ich_id, country)
+        SELECT NEW.ich_id, trim(c) FROM unnest(string_to_array(NEW.countries, ', ')) AS c;
+        IF NEW.primary_concepts IS NOT NULL AND NEW.primary_concepts != '' THEN
+            INSERT INTO cdop.ich_element_concepts (ich_id, concept)
+            SELECT NEW.ich_id, trim(c) FROM unnest(string_to_array(NEW.primary_concepts, '; ')) AS c;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS ich_elements_sync_expansions ON cdop.ich_elements;
+CREATE TRIGGER ich_elements_sync_expansions
+    AFTER INSERT OR DELETE OR UPDATE OF countries, primary_concepts ON cdop.ich_elements
+    FOR EACH ROW EXECUTE FUNCTION cdop.sync_ich_element_expansions();
+
+-- Toponym tables (ich_explore_toponyms.py): (ich_id, toponym) lookups for the
+-- NER-vs-cleaner anti-join and per-element aggregates
+CREATE INDEX IF NOT EXISTS ix_cleaner_ich_topo
+    ON cdop.ich_toponyms_cleaner (ich_id, toponym);
+CREATE INDEX IF NOT EXISTS ix_ner_ich_topo
+    ON cdop.ich_toponyms_ner (ich_id, toponym);
+
+-- Space-separated word count, computed at write time for the complexity buckets
+ALTER TABLE cdop.ich_toponyms_cleaner
+    ADD COLUMN IF NOT EXISTS word_count int
+    GENERATED ALWAYS AS (array_length(string_to_array(toponym, ' '), 1)) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_cleaner_word_count
+    ON cdop.ich_toponyms_cleaner (word_count);
+
+-- Distinct lowercased ICH country names, the join target for telling
+-- country-level toponyms from sub-country ones
+CREATE MATERIALIZED VIEW cdop.country_names AS
+SELECT DISTINCT lower(country) AS country
+FROM cdop.ich_element_countries
+WITH DATA;
+
+CREATE UNIQUE INDEX country_names_country
+    ON cdop.country_names (country);
+
+-- Toponym QC aggregates for ich_explore_toponyms.py, one (kind, key, value)
+-- row per figure. These only change when the toponym tables are reloaded, so
+-- whatever loads them should finish with
+--     REFRESH MATERIALIZED VIEW CONCURRENTLY cdop.mv_toponym_qc_stats;
+-- (or run: python -m scripts.cdop.ich_explore_toponyms --refresh)
+-- It reads cdop.country_names, so refresh that first.
+CREATE MATERIALIZED VIEW cdop.mv_toponym_qc_stats AS
+-- table row counts and element coverage
+SELECT 'counts' AS kind, k.key, k.value
+FROM (VALUES
+    ('ner_rows', (SELECT count(*) FROM cdop.ich_toponyms_ner)),
+    ('ner_elements', (SELECT count(*) FROM (SELECT ich_id FROM cdop.ich_toponyms_ner WHERE ich_id IS NOT NULL GROUP BY ich_id) s)),
+    ('cleaner_rows', (SELECT count(*) FROM cdop.ich_toponyms_cleaner)),
+    ('cleaner_elements', (SELECT count(*) FROM (SELECT ich_id FROM cdop.ich_toponyms_cleaner WHERE ich_id IS NOT NULL GROUP BY ich_id) s)),
+    ('lptsv_rows', (SELECT count(*) FROM cdop.ich_lptsv_raw)),
+    ('lptsv_elements', (SELECT count(*) FROM (SELECT ich_id FROM cdop.ich_lptsv_raw WHERE ich_id IS NOT NULL GROUP BY ich_id) s)),
+    ('total_elements', (SELECT count(*) FROM cdop.ich_elements))
+) AS k(key, value)
+UNION ALL
+-- NER toponyms dropped by cleaning, with occurrence counts
+SELECT 'removed', n.toponym, count(*)
+FROM cdop.ich_toponyms_ner n
+WHERE n.toponym IS NOT NULL
+  AND NOT EXISTS (
+    SELECT 1 FROM cdop.ich_toponyms_cleaner c
+    WHERE c.ich_id = n.ich_id AND c.toponym = n.toponym
+  )
+GROUP BY n.toponym
+UNION ALL
+-- cleaner toponyms by word count
+SELECT 'word_count',
+       CASE
+           WHEN word_count = 1 THEN '1 word'
+           WHEN word_count = 2 THEN '2 words'
+           WHEN word_count = 3 THEN '3 words'
+           ELSE '4+ words'
+       END,
+       count(*)
+FROM cdop.ich_toponyms_cleaner
+GROUP BY 2
+UNION ALL
+-- cleaner toponyms that are (or are not) country names
+SELECT 'country_split', k.key, k.value
+FROM (
+    SELECT count(*) AS total, count(c.country) AS country_level
+    FROM cdop.ich_toponyms_cleaner t
+    LEFT JOIN cdop.country_names c ON lower(t.toponym) = c.country
+) s
+CROSS JOIN LATERAL (VALUES
+    ('total_toponyms', s.total),
+    ('country_level', s.country_level),
+    ('sub_country', s.total - s.country_level)
+) AS k(key, value)
+WITH DATA;
+
+CREATE UNIQUE INDEX mv_toponym_qc_stats_kind_key
+    ON cdop.mv_toponym_qc_stats (kind, key);
+
+-- Number of elements each cleaner toponym appears in (ambiguity ranking in
+-- ich_explore_toponyms.py); refresh alongside mv_toponym_qc_stats
+DROP MATERIALIZED VIEW IF EXISTS cdop.mv_toponym_element_counts;
+CREATE MATERIALIZED VIEW cdop.mv_toponym_element_counts AS
+SELECT toponym, count(DISTINCT ich_id) AS n_elements
+FROM cdop.ich_toponyms_cleaner
+WHERE toponym IS NOT NULL
+GROUP BY toponym
+WITH DATA;
+
+CREATE UNIQUE INDEX mv_toponym_element_counts_toponym
+    ON cdop.mv_toponym_element_counts (toponym);
+CREATE INDEX mv_toponym_element_counts_n
+    ON cdop.mv_toponym_element_counts (n_elements DESC);
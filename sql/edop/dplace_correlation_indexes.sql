@@ -0,0 +1,10 @@
+-- Indexes supporting the in-database env/culture aggregation in
+-- scripts/edop/dplace_env_correlations_exploratory.py (load_category_stats):
+-- dplace_data filtered by var_id and joined on soc_id, societies joined to
+-- basin08 on basin_id = hybas_id
+
+CREATE INDEX IF NOT EXISTS dplace_data_var_soc_idx
+    ON gaz.dplace_data (var_id, soc_id);
+
+CREATE INDEX IF NOT EXISTS dplace_societies_basin_idx
+    ON gaz.dplace_societies (basin_id);
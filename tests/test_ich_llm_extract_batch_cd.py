@@ -0,0 +1,32 @@
+from scripts.cdop.ich_llm_extract_batch_cd import TRUNCATION_MARK, truncate_by_sections
+
+BUDGET = 1000
+
+
+def test_short_document_unchanged():
+    doc = "Intro\n\nLocation\nA village"
+    assert truncate_by_sections(doc, BUDGET) == doc
+
+
+def test_no_blank_lines_falls_back_to_head_cut():
+    doc = ("word " * 600).strip()
+    sent = truncate_by_sections(doc, BUDGET)
+    assert sent.startswith(doc[:BUDGET - 10])
+    assert sent.endswith(TRUNCATION_MARK)
+    assert len(sent) <= BUDGET + len(TRUNCATION_MARK) + 2
+
+
+def test_oversized_first_block_keeps_leading_context_and_geo_section():
+    doc = "Intro\n" + "x" * 3000 + "\n\nLocation\n\nVillage of Foo\n\nOther\nstuff"
+    sent = truncate_by_sections(doc, BUDGET)
+    assert sent.startswith("Intro\nxxx")
+    assert "Location\n\nVillage of Foo" in sent
+    assert "Other" not in sent
+    assert sent.count(TRUNCATION_MARK) == 2
+
+
+def test_oversized_geo_block_is_cut_not_dropped():
+    doc = "Intro\nabc\n\nGeographic location\n" + "g" * 3000 + "\n\nEnd"
+    sent = truncate_by_sections(doc, BUDGET)
+    assert sent.startswith("Intro\nabc\n\nGeographic location\nggg")
+    assert sent.endswith(TRUNCATION_MARK)